@@ -0,0 +1,121 @@
+import argparse
+import os
+import time
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+from headless import pose_game, START_TIME
+
+import pygame
+
+from cave_explorer import Game, SimulationClock, build_assets, SCREEN_WIDTH, SCREEN_HEIGHT
+
+CHUNK_FRAMES = 8  # Frames rendered by one worker task
+WINDOW_PER_WORKER = 4  # Tasks in flight per worker, which bounds buffered frames
+
+# (state, seed, start progress, end progress, frames) for every animation,
+# rendered by default
+DEFAULT_JOBS = [
+    ("playing", 1, 0.0, 1.0, 60),
+    ("success", 1, 0.0, 1.0, 60),
+    ("trap", 1, 0.0, 1.0, 60),
+    ("dead_end", 1, 0.0, 1.0, 60),
+    ("victory", 1, 0.0, 1.0, 60),
+]
+
+# Headless Game per seed in this worker process, created on first use.
+# Workers only load the images; the parent builds them before starting the pool
+worker_games = {}
+
+def worker_game(seed):
+    key = seed
+    if key not in worker_games:
+        worker_games[key] = Game(seed=seed, clock=SimulationClock(START_TIME))
+    return worker_games[key]
+
+def frame_progress(job, frame):
+    # Animation progress of one frame, spread evenly over the job's range
+    state, seed, start, end, frames = job
+    return start + (end - start) * frame / max(1, frames - 1)
+
+def frame_path(output_dir, index, job, frame):
+    # e.g. frames/02_trap_1_0007.png for frame 7 of the third job
+    state, seed = job[:2]
+    return os.path.join(output_dir, "%02d_%s_%d_%04d.png" % (index, state, seed, frame))
+
+def render_chunk(index, job, first, count, output_dir):
+    # Render frames first .. first + count - 1 of a job and save them as PNGs
+    # in output_dir. The worker encodes and writes its own frames, so only
+    # their paths go back to the parent process
+    state, seed = job[:2]
+    game = worker_game(seed)
+    
+    surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    paths = []
+    for frame in range(first, first + count):
+        pose_game(game, state, frame_progress(job, frame), flicker=frame * 0.1)
+        game.render_frame(surface)
+        paths.append(frame_path(output_dir, index, job, frame))
+        pygame.image.save(surface, paths[-1])
+    return paths
+
+def render_animations(jobs, output_dir, workers=os.cpu_count() or 1, chunk_frames=CHUNK_FRAMES):
+    # Render every frame of every job to a PNG in output_dir, spread over a
+    # process pool in chunks of chunk_frames, and yield (job index, frame
+    # index, path) in order as soon as each frame and all frames before it are
+    # written. Only a few chunks per worker are in flight. The generated images
+    # are brought up to date here, once, so that workers never write them
+    build_assets()
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(index, first, min(chunk_frames, job[4] - first))
+             for index, job in enumerate(jobs)
+             for first in range(0, job[4], chunk_frames)]
+    
+    if workers <= 1:
+        for index, first, count in tasks:
+            for offset, path in enumerate(render_chunk(index, jobs[index], first, count, output_dir)):
+                yield index, first + offset, path
+        return
+    
+    with ProcessPoolExecutor(workers) as pool:
+        def submit(task):
+            index, first, count = task
+            return index, first, pool.submit(render_chunk, index, jobs[index], first, count, output_dir)
+        
+        queued = iter(tasks)
+        pending = deque(submit(task) for task in islice(queued, workers * WINDOW_PER_WORKER))
+        while pending:
+            index, first, future = pending.popleft()
+            for offset, path in enumerate(future.result()):
+                yield index, first + offset, path
+            
+            # Keep the window full
+            for task in islice(queued, 1):
+                pending.append(submit(task))
+
+def parse_job(text):
+    # state:seed:start:end:frames, e.g. trap:7:0:1:30
+    state, seed, start, end, frames = text.split(':')
+    return (state, int(seed), float(start), float(end), int(frames))
+
+def main():
+    parser = argparse.ArgumentParser(description="Render Cave Explorer animations to numbered PNG frames")
+    parser.add_argument('--job', action='append', type=parse_job, dest='jobs',
+                        help="state:seed:start:end:frames (repeatable; default: every animation)")
+    parser.add_argument('--output-dir', default='frames', help="directory the frames are written to")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker processes")
+    args = parser.parse_args()
+    
+    jobs = args.jobs or DEFAULT_JOBS
+    
+    start = time.perf_counter()
+    total = 0
+    for index, frame, path in render_animations(jobs, args.output_dir, args.workers):
+        total += 1
+    elapsed = time.perf_counter() - start
+    
+    print("%d frames in %.2f s (%.1f frames/s, %d workers)" % (total, elapsed, total / elapsed, args.workers))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from headless import percentile, pose_game, write_report, START_TIME
+
+import pygame
+
+import cave_explorer
+from cave_explorer import Game, SimulationClock, SCREEN_WIDTH, SCREEN_HEIGHT
+
+# Default location of the stored baseline, next to this file
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# A state is a regression when its mean frame time grows by more than this
+# fraction over the baseline and by more than TIME_FLOOR_MS, or when it issues
+# more draw calls. The floor keeps scheduling jitter on sub-millisecond
+# states from counting as a regression
+TIME_TOLERANCE = 0.25
+TIME_FLOOR_MS = 0.25
+
+RUNS = 3  # Runs of every case; the median run is compared
+
+SEED = 1234
+
+# (case name, state, perspective offset). The playing state is measured at
+# several view angles, the other states over their whole animation
+CASES = [
+    ("playing_left", "playing", -0.3),
+    ("playing_left_half", "playing", -0.1),
+    ("playing_center", "playing", 0.0),
+    ("playing_right_half", "playing", 0.1),
+    ("playing_right", "playing", 0.3),
+    ("success", "success", 0.0),
+    ("trap", "trap", 0.0),
+    ("dead_end", "dead_end", 0.0),
+    ("victory", "victory", 0.0),
+]
+
+def run_case(game, surface, state, offset, frames, warmup):
+    # One run of a case: returns the milliseconds and draw calls of each timed
+    # frame. The animated states are sampled evenly from the start to the end
+    # of their animation; the playing state just keeps its torches flickering
+    frame_times = []
+    draw_calls = []
+    for frame in range(warmup + frames):
+        pose_game(game, state, (frame % frames) / max(1, frames - 1), offset, flicker=frame * 0.1)
+        calls_before = game.draw_calls
+        
+        start = time.perf_counter()
+        game.draw(surface)
+        elapsed = time.perf_counter() - start
+        
+        if frame >= warmup:
+            frame_times.append(elapsed * 1000)
+            draw_calls.append(game.draw_calls - calls_before)
+    return frame_times, draw_calls
+
+def summarize_case(runs, frames):
+    # Combine the runs of a case. mean_ms is the median of the runs' means,
+    # so one run disturbed by the machine does not move it; percentiles and
+    # draw calls cover every timed frame
+    run_means = sorted(sum(frame_times) / frames for frame_times, draw_calls in runs)
+    frame_times = [ms for times, calls in runs for ms in times]
+    draw_calls = [count for times, calls in runs for count in calls]
+    mean = run_means[len(run_means) // 2]
+    return {
+        "frames": frames,
+        "fps": round(1000 / mean, 2) if mean else None,
+        "mean_ms": round(mean, 3),
+        "run_means_ms": [round(ms, 3) for ms in run_means],
+        "p50_ms": round(percentile(frame_times, 0.5), 3),
+        "p99_ms": round(percentile(frame_times, 0.99), 3),
+        "draw_calls": round(sum(draw_calls) / len(draw_calls), 1),
+    }
+
+def run_startup():
+    # Cold start: every generated image built from scratch into an empty
+    # directory, as on a first run, then loaded
+    with tempfile.TemporaryDirectory() as image_dir:
+        start = time.perf_counter()
+        report = cave_explorer.build_assets(image_dir)
+        images = cave_explorer.AssetRegistry(image_dir, report)
+        for name in cave_explorer.ASSETS:
+            images[name]
+        total = time.perf_counter() - start
+    
+    return {
+        "cold_ms": round(total * 1000, 3),
+        "assets": {name: {"build_ms": asset["build_ms"], "load_ms": asset["load_ms"]}
+                   for name, asset in report.items()},
+    }
+
+def run_benchmark(frames=60, warmup=5, runs=RUNS):
+    pygame.font.init()
+    
+    # Every draw sees the same timestamps on every run. Each run gets a new
+    # game, so every run bakes its caches like the first and does the same work
+    surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    states = {}
+    assets_used = set()
+    for name, state, offset in CASES:
+        case_runs = []
+        for _ in range(runs):
+            game = Game(seed=SEED, clock=SimulationClock(START_TIME))
+            case_runs.append(run_case(game, surface, state, offset, frames, warmup))
+            assets_used.update(asset for asset, usage in game.images.usage().items() if usage["loaded"])
+        states[name] = summarize_case(case_runs, frames)
+    
+    return {
+        "frames": frames,
+        "runs": runs,
+        "pygame": pygame.version.ver,
+        "python": sys.version.split()[0],
+        "startup": run_startup(),
+        "assets_used": sorted(assets_used),
+        "states": states,
+    }
+
+def slower(current_ms, previous_ms, tolerance, floor_ms):
+    return current_ms - previous_ms > max(previous_ms * tolerance, floor_ms)
+
+def compare(results, baseline, tolerance=TIME_TOLERANCE, floor_ms=TIME_FLOOR_MS):
+    # Return a list of human readable regressions against the baseline
+    regressions = []
+    
+    # The first frames of a state bake its cache layers, so draw calls per
+    # frame only compare between benchmarks of the same length
+    for setting in ("frames", "runs"):
+        if baseline.get(setting) != results[setting]:
+            return ["baseline was recorded with %s=%s" % (setting, baseline.get(setting))]
+    
+    previous_startup = baseline.get("startup")
+    if previous_startup and slower(results["startup"]["cold_ms"], previous_startup["cold_ms"], tolerance, floor_ms):
+        regressions.append("startup: cold start %.3f ms vs baseline %.3f ms" %
+                           (results["startup"]["cold_ms"], previous_startup["cold_ms"]))
+    
+    for name, current in results["states"].items():
+        previous = baseline["states"].get(name)
+        if previous is None:
+            continue
+        if slower(current["mean_ms"], previous["mean_ms"], tolerance, floor_ms):
+            regressions.append("%s: mean %.3f ms vs baseline %.3f ms" %
+                               (name, current["mean_ms"], previous["mean_ms"]))
+        if current["draw_calls"] > previous["draw_calls"]:
+            regressions.append("%s: %.1f draw calls vs baseline %.1f" %
+                               (name, current["draw_calls"], previous["draw_calls"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Cave Explorer frame times per game state")
+    parser.add_argument('--frames', type=int, default=60, help="timed frames per state")
+    parser.add_argument('--warmup', type=int, default=5, help="untimed frames before each run of a state")
+    parser.add_argument('--runs', type=int, default=RUNS, help="runs of every state; the median run is compared")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline file to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TIME_TOLERANCE,
+                        help="allowed mean frame time increase as a fraction (default %(default)s)")
+    parser.add_argument('--floor', type=float, default=TIME_FLOOR_MS,
+                        help="mean frame time increase in ms always allowed (default %(default)s)")
+    args = parser.parse_args()
+    
+    # The images the states draw must be current before the game loads them
+    cave_explorer.build_assets()
+    if args.frames < 1 or args.runs < 1:
+        parser.error("--frames and --runs must be at least 1")
+    results = run_benchmark(args.frames, args.warmup, args.runs)
+    
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            results["regressions"] = compare(results, json.load(f), args.tolerance, args.floor)
+    
+    report = write_report(results, args.output)
+    
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(report + "\n")
+    
+    if results.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
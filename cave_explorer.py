@@ -1,19 +1,123 @@
 import pygame
+import numpy
 import sys
 import random
 import time
 import os
 import math
-
-# Initialize pygame
-pygame.init()
-pygame.font.init()
+import json
+import hashlib
+import inspect
+import struct
+import gc
+import tracemalloc
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor
 
 # Constants
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 FPS = 60
+TICK_SECONDS = 1 / 60  # Length of one fixed simulation step
+MAX_CATCH_UP_TICKS = 5  # Most simulation steps run to catch up after a slow frame
 PIXEL_SIZE = 4  # Size of each "pixel" in our pixel art
+CAVE_LAYER_CACHE_SIZE = 8  # Number of baked cave layers kept (one per perspective offset)
+PATH_CENTERS = [0.25, 0.5, 0.75]  # Left, middle, right tunnel positions
+WIN_STREAK = 5  # Correct paths in a row needed to find the treasure
+TRAP_CHANCE = 0.5  # Chance that a wrong path is a trap rather than a dead end
+TRANSITION_SECONDS = 1.0  # Time spent in the success state before the next fork
+TEXT_CACHE_SIZE = 64  # Number of rendered text Surfaces kept by the text cache
+TORCH_LIGHT_RADIUS = 50  # Torch light radius, flickering up to 10 pixels larger
+GLOW_RADIUS = 50  # Radius of the glow under the selected path
+ANIMATION_FRAMES = 30  # Cached frames per trap / falling rocks animation
+ROCK_SHAPE_CACHE_SIZE = 32  # Rock shapes (and their sprites) kept between frames
+TEXTURE_BLOCKS = 48  # Cave textures repeat every 48 x 48 pixel art blocks
+TEXTURE_CONTRAST = 12  # Largest brightness change the texture noise adds
+PARTICLE_SPRITE_CACHE_SIZE = 64  # Particle sprites kept (one per shape, size and color)
+
+# Integer setting from the environment variable name, or None when it is
+# unset. Anything but an integer from low to high is refused at startup
+def int_setting(name, low, high):
+    text = os.environ.get(name)
+    if not text:
+        return None
+    try:
+        value = int(text)
+    except ValueError:
+        value = None
+    if value is None or not low <= value <= high:
+        raise ValueError("%s must be an integer from %d to %d, not %r" % (name, low, high, text))
+    return value
+
+# Frame profiler: F3 toggles the overlay, CAVE_PROFILE=1 turns it on at startup
+# and CAVE_PROFILE_LOG=<file> appends one JSON line per frame to that file
+PROFILER_KEY = pygame.K_F3
+PROFILE_WINDOW = 120  # Frames averaged by the overlay bars
+
+# CAVE_TRACK_ALLOCATIONS=1 adds the bytes each stage allocates (Python objects
+# through tracemalloc, Surfaces through the surface pool) and the garbage
+# collector's pauses to the profiler. tracemalloc slows everything down, so
+# frame times are only comparable between runs with the same setting
+TRACK_ALLOCATIONS = os.environ.get('CAVE_TRACK_ALLOCATIONS', '0') == '1'
+
+# Frame-time telemetry: CAVE_STATS=<file> appends a snapshot of the frame-time
+# histograms there every STATS_INTERVAL seconds, and a line for every jank
+FRAME_STATS_PATH = os.environ.get('CAVE_STATS') or None
+STATS_INTERVAL = 60  # Seconds between snapshots
+HISTOGRAM_BUCKET_MS = 0.5  # Width of a frame-time histogram bucket...
+HISTOGRAM_BUCKETS = 200  # ...and their number; longer frames share the last one
+OVER_BUDGET_SLACK_MS = 2  # Frames may overrun the budget by the frame cap's jitter
+JANK_FACTOR = 2  # A frame taking this many frame budgets is a jank
+
+# Low-latency mode (CAVE_LOW_LATENCY=1): instead of capping the frame rate after
+# the flip, wait before polling input until just enough time is left to
+# render by the frame deadline, and wait precisely rather than in whole
+# milliseconds. Spinning out the last moments of every wait costs some CPU
+LOW_LATENCY = os.environ.get('CAVE_LOW_LATENCY', '0') == '1'
+RENDER_ESTIMATE_WINDOW = 30  # Frames whose slowest render predicts the next
+LATENCY_MARGIN_SECONDS = 0.001  # Kept in hand on top of the predicted render
+SLEEP_SLACK_SECONDS = 0.002  # time.sleep() may oversleep by this much, so spin instead
+
+# Upload only the regions that changed since the last frame instead of flipping
+# the whole screen (set CAVE_DIRTY_RECTS=1 to enable)
+DIRTY_RECT_PRESENTATION = os.environ.get('CAVE_DIRTY_RECTS', '0') == '1'
+
+# Session seed for the correct paths, traps and the random details of
+# animations (dust, cracks, tunnel texture, spilled treasure); CAVE_SEED=<n>
+# pins it (0 to 2**64 - 1, the range an input log can store), otherwise it is
+# random
+SESSION_SEED = int_setting('CAVE_SEED', 0, 2**64 - 1)
+
+# CAVE_RECORD=<file> records the session's key presses there (see InputRecorder)
+INPUT_RECORDING = os.environ.get('CAVE_RECORD')
+INPUT_LOG_MAGIC = b'CAVE'
+INPUT_LOG_VERSION = 1
+INPUT_LOG_HEADER = struct.Struct('<4sBQ')  # Magic, version, seed
+INPUT_LOG_EVENT = struct.Struct('<IdI')  # Tick, interpolation, key (0 ends the log)
+GAME_KEYS = (pygame.K_LEFT, pygame.K_UP, pygame.K_RIGHT, pygame.K_SPACE)  # Keys Game.handle_key acts on
+
+# Adaptive quality: (effect density, block size multiplier) per level, best
+# first. Lower levels draw fewer sparkles, dust, blur rays and tunnel segments,
+# and the lowest draw the tunnel in blocks of twice the pixel size
+QUALITY_LEVELS = [
+    (1.0, 1),
+    (0.75, 1),
+    (0.5, 1),
+    (0.5, 2),
+    (0.25, 2),
+]
+QUALITY_WINDOW = 30  # Frames averaged before the quality level may change
+QUALITY_DOWNGRADE = 0.9  # Drop a level when frames take over 90% of the budget...
+QUALITY_UPGRADE = 0.5  # ...and only go back up when they take under 50%
+
+# CAVE_QUALITY=<level> pins the quality level (0 is best); by default it adapts
+QUALITY_LEVEL = int_setting('CAVE_QUALITY', 0, len(QUALITY_LEVELS) - 1)
+
+# Generated images live next to this file, whatever the working directory
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+ASSET_MANIFEST = 'manifest.json'  # Hashes of the generated images
+ASSET_BUILD_WORKERS = os.cpu_count() or 1  # Processes used to rebuild stale images
 
 # Colors
 BLACK = (0, 0, 0)
@@ -29,350 +133,1410 @@ CAVE_WALL = (70, 45, 30)
 CAVE_FLOOR = (120, 100, 80)
 CAVE_DARK = (40, 25, 15)
 CAVE_HIGHLIGHT = (150, 120, 100)
+SPRITE_COLORKEY = (255, 0, 255)  # Transparent color of shape sprites
+TREASURE_COLORS = [
+    GOLD,                  # Gold
+    (192, 192, 192),       # Silver
+    (255, 0, 0),           # Ruby
+    (0, 0, 255),           # Sapphire
+    (0, 255, 0),           # Emerald
+    (255, 0, 255),         # Amethyst
+    (0, 255, 255)          # Diamond
+]
+
+# Every color used by the cached trap and falling rocks frames (and the shape
+# sprites drawn into them), which are stored as 8-bit palettized Surfaces
+ANIMATION_PALETTE = [
+    CAVE_DARK,
+    CAVE_FLOOR,
+    (CAVE_FLOOR[0] - 20, CAVE_FLOOR[1] - 20, CAVE_FLOOR[2] - 20),
+    GRAY,
+    (GRAY[0] - 20, GRAY[1] - 20, GRAY[2] - 20),
+    (GRAY[0] - 30, GRAY[1] - 30, GRAY[2] - 30),
+    WHITE,
+    SPRITE_COLORKEY,
+]
 
-# Set up the screen
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Cave Explorer")
-clock = pygame.time.Clock()
+# Asset generators. Each one draws an image from its parameters, taking its
+# randomness from rng so the same parameters always give the same art
+def generate_treasure_image(params, rng):
+    width, height = params["size"]
+    treasure_img = pygame.Surface((width, height))
+    
+    # Background color - cave interior
+    treasure_img.fill(CAVE_DARK)
+    
+    # Draw cave floor
+    pygame.draw.rect(treasure_img, CAVE_FLOOR, (0, height//2, width, height//2))
+    
+    # Draw treasure chest
+    chest_width = 300
+    chest_height = 200
+    chest_x = (width - chest_width) // 2
+    chest_y = (height - chest_height) // 2
+    
+    # Chest base
+    pygame.draw.rect(treasure_img, BROWN, (chest_x, chest_y + chest_height//3, 
+                                         chest_width, chest_height - chest_height//3))
+    pygame.draw.rect(treasure_img, DARK_BROWN, (chest_x, chest_y + chest_height//3, 
+                                              chest_width, chest_height - chest_height//3), 3)
+    
+    # Chest top (open)
+    pygame.draw.rect(treasure_img, BROWN, (chest_x, chest_y - chest_height//3, chest_width, chest_height//3))
+    pygame.draw.rect(treasure_img, DARK_BROWN, (chest_x, chest_y - chest_height//3, chest_width, chest_height//3), 3)
+    
+    # Chest hinge
+    pygame.draw.rect(treasure_img, DARK_BROWN, (chest_x, chest_y, chest_width, 10))
+    
+    # Gold, silver and gems inside and spilling out
+    treasure_colors = [
+        GOLD,                  # Gold
+        (192, 192, 192),       # Silver
+        (255, 0, 0),           # Ruby
+        (0, 0, 255),           # Sapphire
+        (0, 255, 0),           # Emerald
+        (255, 0, 255),         # Amethyst
+        (0, 255, 255)          # Diamond
+    ]
+    
+    # Draw piles of treasure
+    for _ in range(200):
+        x = rng.randint(chest_x + 20, chest_x + chest_width - 20)
+        y = rng.randint(chest_y, chest_y + chest_height - 20)
+        size = rng.randint(5, 15)
+        color = rng.choice(treasure_colors)
+        pygame.draw.circle(treasure_img, color, (x, y), size)
+    
+    # Add light rays emanating from the treasure
+    for angle in range(0, 360, 10):
+        rad = math.radians(angle)
+        length = rng.randint(100, 300)
+        end_x = chest_x + chest_width//2 + math.cos(rad) * length
+        end_y = chest_y + chest_height//2 + math.sin(rad) * length
+        
+        # Draw light ray
+        pygame.draw.line(treasure_img, (255, 255, 100, 100), 
+                       (chest_x + chest_width//2, chest_y + chest_height//2),
+                       (end_x, end_y), 2)
+    
+    # Add shining effect (bright spots)
+    for _ in range(50):
+        x = rng.randint(chest_x - 50, chest_x + chest_width + 50)
+        y = rng.randint(chest_y - 50, chest_y + chest_height + 50)
+        size = rng.randint(2, 8)
+        pygame.draw.circle(treasure_img, WHITE, (x, y), size)
+    
+    # Add glow effect around the chest. Each ring is drawn on one reused
+    # surface just big enough for the largest ring rather than a new
+    # full-screen SRCALPHA surface per ring
+    glow_radius = 200
+    glow = pygame.Surface((glow_radius * 2, glow_radius * 2), pygame.SRCALPHA)
+    glow_pos = (chest_x + chest_width//2 - glow_radius, chest_y + chest_height//2 - glow_radius)
+    for radius in range(glow_radius, 0, -10):
+        alpha = max(0, 100 - radius // 2)
+        glow.fill((0, 0, 0, 0))
+        pygame.draw.circle(glow, (255, 255, 100, alpha), (glow_radius, glow_radius), radius)
+        treasure_img.blit(glow, glow_pos)
+    
+    return treasure_img
 
-# Load or create images
-def load_images():
-    images = {}
+def generate_trap_image(params, rng):
+    width, height = params["size"]
+    trap_img = pygame.Surface((width, height))
+    trap_img.fill(CAVE_DARK)
     
-    # Create the images directory if it doesn't exist
-    if not os.path.exists('images'):
-        os.makedirs('images')
+    # Draw cave floor and walls
+    pygame.draw.rect(trap_img, CAVE_FLOOR, (0, height//2, width, height//2))
     
-    # Create or load treasure chest image
-    treasure_path = 'images/treasure_chest_shining.png'
-    if not os.path.exists(treasure_path):
-        treasure_img = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    # Draw spikes coming from all directions (approaching the player)
+    spike_width = 20
+    
+    # Spikes from floor
+    for x in range(0, width, 40):
+        spike_height = rng.randint(50, 150)
+        points = [
+            (x, height // 2),
+            (x + spike_width, height // 2),
+            (x + spike_width // 2, height // 2 - spike_height)
+        ]
+        pygame.draw.polygon(trap_img, GRAY, points)
         
-        # Background color - cave interior
-        treasure_img.fill(CAVE_DARK)
+        # Add metallic highlights
+        highlight_points = [
+            (x + spike_width // 4, height // 2),
+            (x + spike_width // 4, height // 2 - spike_height * 0.8)
+        ]
+        pygame.draw.line(trap_img, WHITE, highlight_points[0], highlight_points[1], 2)
+    
+    # Spikes from ceiling
+    for x in range(20, width, 40):
+        spike_height = rng.randint(50, 150)
+        points = [
+            (x, 0),
+            (x + spike_width, 0),
+            (x + spike_width // 2, spike_height)
+        ]
+        pygame.draw.polygon(trap_img, GRAY, points)
         
-        # Draw cave floor
-        pygame.draw.rect(treasure_img, CAVE_FLOOR, (0, SCREEN_HEIGHT//2, SCREEN_WIDTH, SCREEN_HEIGHT//2))
+        # Add metallic highlights
+        highlight_points = [
+            (x + spike_width * 3 // 4, 0),
+            (x + spike_width * 3 // 4, spike_height * 0.8)
+        ]
+        pygame.draw.line(trap_img, WHITE, highlight_points[0], highlight_points[1], 2)
+    
+    # Spikes from left wall
+    for y in range(height // 4, height * 3 // 4, 40):
+        length = rng.randint(50, 150)
+        points = [
+            (0, y),
+            (0, y + spike_width),
+            (length, y + spike_width // 2)
+        ]
+        pygame.draw.polygon(trap_img, GRAY, points)
         
-        # Draw treasure chest
-        chest_width = 300
-        chest_height = 200
-        chest_x = (SCREEN_WIDTH - chest_width) // 2
-        chest_y = (SCREEN_HEIGHT - chest_height) // 2
+        # Add metallic highlights
+        highlight_points = [
+            (0, y + spike_width * 3 // 4),
+            (length * 0.8, y + spike_width // 2)
+        ]
+        pygame.draw.line(trap_img, WHITE, highlight_points[0], highlight_points[1], 2)
+    
+    # Spikes from right wall
+    for y in range(height // 4, height * 3 // 4, 40):
+        length = rng.randint(50, 150)
+        points = [
+            (width, y),
+            (width, y + spike_width),
+            (width - length, y + spike_width // 2)
+        ]
+        pygame.draw.polygon(trap_img, GRAY, points)
         
-        # Chest base
-        pygame.draw.rect(treasure_img, BROWN, (chest_x, chest_y + chest_height//3, 
-                                             chest_width, chest_height - chest_height//3))
-        pygame.draw.rect(treasure_img, DARK_BROWN, (chest_x, chest_y + chest_height//3, 
-                                                  chest_width, chest_height - chest_height//3), 3)
-        
-        # Chest top (open)
-        pygame.draw.rect(treasure_img, BROWN, (chest_x, chest_y - chest_height//3, chest_width, chest_height//3))
-        pygame.draw.rect(treasure_img, DARK_BROWN, (chest_x, chest_y - chest_height//3, chest_width, chest_height//3), 3)
-        
-        # Chest hinge
-        pygame.draw.rect(treasure_img, DARK_BROWN, (chest_x, chest_y, chest_width, 10))
-        
-        # Gold, silver and gems inside and spilling out
-        treasure_colors = [
-            GOLD,                  # Gold
-            (192, 192, 192),       # Silver
-            (255, 0, 0),           # Ruby
-            (0, 0, 255),           # Sapphire
-            (0, 255, 0),           # Emerald
-            (255, 0, 255),         # Amethyst
-            (0, 255, 255)          # Diamond
+        # Add metallic highlights
+        highlight_points = [
+            (width, y + spike_width * 1 // 4),
+            (width - length * 0.8, y + spike_width // 2)
         ]
+        pygame.draw.line(trap_img, WHITE, highlight_points[0], highlight_points[1], 2)
+    
+    # Add motion blur effect to suggest spikes are moving
+    for _ in range(50):
+        # Random position near center
+        center_x = width // 2
+        center_y = height // 2
+        
+        x = center_x + rng.randint(-width//4, width//4)
+        y = center_y + rng.randint(-height//4, height//4)
+        
+        # Calculate direction from edge to center
+        dx = center_x - x
+        dy = center_y - y
+        length = math.sqrt(dx*dx + dy*dy)
+        
+        if length > 0:
+            dx /= length
+            dy /= length
+            
+            # Draw motion blur line
+            blur_length = rng.randint(10, 30)
+            pygame.draw.line(trap_img, (150, 150, 150), 
+                           (x, y), 
+                           (x - dx * blur_length, y - dy * blur_length), 
+                           2)
+    
+    return trap_img
+
+def generate_dead_end_image(params, rng):
+    width, height = params["size"]
+    dead_end_img = pygame.Surface((width, height))
+    dead_end_img.fill(CAVE_DARK)
+    
+    # Draw cave floor
+    pygame.draw.rect(dead_end_img, CAVE_FLOOR, (0, height//2, width, height//2))
+    
+    # Draw rocks falling from ceiling
+    for _ in range(20):
+        # Random position and size
+        x = rng.randint(0, width)
+        y = rng.randint(0, height * 3 // 4)  # Mostly in upper part of screen
+        size = rng.randint(30, 100)
         
-        # Draw piles of treasure
-        for _ in range(200):
-            x = random.randint(chest_x + 20, chest_x + chest_width - 20)
-            y = random.randint(chest_y, chest_y + chest_height - 20)
-            size = random.randint(5, 15)
-            color = random.choice(treasure_colors)
-            pygame.draw.circle(treasure_img, color, (x, y), size)
-        
-        # Add light rays emanating from the treasure
-        for angle in range(0, 360, 10):
-            rad = math.radians(angle)
-            length = random.randint(100, 300)
-            end_x = chest_x + chest_width//2 + math.cos(rad) * length
-            end_y = chest_y + chest_height//2 + math.sin(rad) * length
-            
-            # Draw light ray
-            pygame.draw.line(treasure_img, (255, 255, 100, 100), 
-                           (chest_x + chest_width//2, chest_y + chest_height//2),
-                           (end_x, end_y), 2)
-        
-        # Add shining effect (bright spots)
-        for _ in range(50):
-            x = random.randint(chest_x - 50, chest_x + chest_width + 50)
-            y = random.randint(chest_y - 50, chest_y + chest_height + 50)
-            size = random.randint(2, 8)
-            pygame.draw.circle(treasure_img, WHITE, (x, y), size)
-        
-        # Add glow effect around the chest
-        for radius in range(200, 0, -10):
-            alpha = max(0, 100 - radius // 2)
-            temp_surf = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-            pygame.draw.circle(temp_surf, (255, 255, 100, alpha), 
-                             (chest_x + chest_width//2, chest_y + chest_height//2), radius)
-            treasure_img.blit(temp_surf, (0, 0))
-        
-        pygame.image.save(treasure_img, treasure_path)
-    
-    images['treasure'] = pygame.image.load(treasure_path)
-    
-    # Create or load trap image (approaching spikes)
-    trap_path = 'images/trap_approaching_spikes.png'
-    if not os.path.exists(trap_path):
-        trap_img = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-        trap_img.fill(CAVE_DARK)
-        
-        # Draw cave floor and walls
-        pygame.draw.rect(trap_img, CAVE_FLOOR, (0, SCREEN_HEIGHT//2, SCREEN_WIDTH, SCREEN_HEIGHT//2))
-        
-        # Draw spikes coming from all directions (approaching the player)
-        # Spikes from floor
-        for x in range(0, SCREEN_WIDTH, 40):
-            height = random.randint(50, 150)
-            width = 20
-            points = [
-                (x, SCREEN_HEIGHT // 2),
-                (x + width, SCREEN_HEIGHT // 2),
-                (x + width // 2, SCREEN_HEIGHT // 2 - height)
-            ]
-            pygame.draw.polygon(trap_img, GRAY, points)
-            
-            # Add metallic highlights
-            highlight_points = [
-                (x + width // 4, SCREEN_HEIGHT // 2),
-                (x + width // 4, SCREEN_HEIGHT // 2 - height * 0.8)
-            ]
-            pygame.draw.line(trap_img, WHITE, highlight_points[0], highlight_points[1], 2)
+        # Draw rock
+        pygame.draw.circle(dead_end_img, GRAY, (x, y), size)
         
-        # Spikes from ceiling
-        for x in range(20, SCREEN_WIDTH, 40):
-            height = random.randint(50, 150)
-            width = 20
-            points = [
-                (x, 0),
-                (x + width, 0),
-                (x + width // 2, height)
-            ]
-            pygame.draw.polygon(trap_img, GRAY, points)
-            
-            # Add metallic highlights
-            highlight_points = [
-                (x + width * 3 // 4, 0),
-                (x + width * 3 // 4, height * 0.8)
-            ]
-            pygame.draw.line(trap_img, WHITE, highlight_points[0], highlight_points[1], 2)
-        
-        # Spikes from left wall
-        for y in range(SCREEN_HEIGHT // 4, SCREEN_HEIGHT * 3 // 4, 40):
-            length = random.randint(50, 150)
-            width = 20
-            points = [
-                (0, y),
-                (0, y + width),
-                (length, y + width // 2)
-            ]
-            pygame.draw.polygon(trap_img, GRAY, points)
-            
-            # Add metallic highlights
-            highlight_points = [
-                (0, y + width * 3 // 4),
-                (length * 0.8, y + width // 2)
-            ]
-            pygame.draw.line(trap_img, WHITE, highlight_points[0], highlight_points[1], 2)
-        
-        # Spikes from right wall
-        for y in range(SCREEN_HEIGHT // 4, SCREEN_HEIGHT * 3 // 4, 40):
-            length = random.randint(50, 150)
-            width = 20
-            points = [
-                (SCREEN_WIDTH, y),
-                (SCREEN_WIDTH, y + width),
-                (SCREEN_WIDTH - length, y + width // 2)
-            ]
-            pygame.draw.polygon(trap_img, GRAY, points)
-            
-            # Add metallic highlights
-            highlight_points = [
-                (SCREEN_WIDTH, y + width * 1 // 4),
-                (SCREEN_WIDTH - length * 0.8, y + width // 2)
-            ]
-            pygame.draw.line(trap_img, WHITE, highlight_points[0], highlight_points[1], 2)
-        
-        # Add motion blur effect to suggest spikes are moving
-        for _ in range(50):
-            # Random position near center
-            center_x = SCREEN_WIDTH // 2
-            center_y = SCREEN_HEIGHT // 2
-            
-            x = center_x + random.randint(-SCREEN_WIDTH//4, SCREEN_WIDTH//4)
-            y = center_y + random.randint(-SCREEN_HEIGHT//4, SCREEN_HEIGHT//4)
-            
-            # Calculate direction from edge to center
-            dx = center_x - x
-            dy = center_y - y
-            length = math.sqrt(dx*dx + dy*dy)
-            
-            if length > 0:
-                dx /= length
-                dy /= length
-                
-                # Draw motion blur line
-                blur_length = random.randint(10, 30)
-                pygame.draw.line(trap_img, (150, 150, 150), 
-                               (x, y), 
-                               (x - dx * blur_length, y - dy * blur_length), 
-                               2)
-        
-        pygame.image.save(trap_img, trap_path)
-    
-    images['trap'] = pygame.image.load(trap_path)
-    
-    # Create or load dead end image (falling rocks)
-    dead_end_path = 'images/dead_end_falling_rocks.png'
-    if not os.path.exists(dead_end_path):
-        dead_end_img = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-        dead_end_img.fill(CAVE_DARK)
-        
-        # Draw cave floor
-        pygame.draw.rect(dead_end_img, CAVE_FLOOR, (0, SCREEN_HEIGHT//2, SCREEN_WIDTH, SCREEN_HEIGHT//2))
-        
-        # Draw rocks falling from ceiling
-        for _ in range(20):
-            # Random position and size
-            x = random.randint(0, SCREEN_WIDTH)
-            y = random.randint(0, SCREEN_HEIGHT * 3 // 4)  # Mostly in upper part of screen
-            size = random.randint(30, 100)
-            
-            # Draw rock
-            pygame.draw.circle(dead_end_img, GRAY, (x, y), size)
-            
-            # Add some texture to rocks
-            for i in range(5):
-                inner_x = random.randint(x - size + 10, x + size - 10)
-                inner_y = random.randint(y - size + 10, y + size - 10)
-                inner_size = random.randint(5, 15)
-                pygame.draw.circle(dead_end_img, DARK_BROWN, (inner_x, inner_y), inner_size)
-            
-            # Add motion blur effect (lines trailing behind rocks)
-            blur_length = random.randint(20, 50)
-            pygame.draw.line(dead_end_img, GRAY, 
+        # Add some texture to rocks
+        for i in range(5):
+            inner_x = rng.randint(x - size + 10, x + size - 10)
+            inner_y = rng.randint(y - size + 10, y + size - 10)
+            inner_size = rng.randint(5, 15)
+            pygame.draw.circle(dead_end_img, DARK_BROWN, (inner_x, inner_y), inner_size)
+        
+        # Add motion blur effect (lines trailing behind rocks)
+        blur_length = rng.randint(20, 50)
+        pygame.draw.line(dead_end_img, GRAY, 
+                       (x, y), 
+                       (x, y - blur_length), 
+                       size // 2)
+    
+    # Add dust and small debris
+    for _ in range(100):
+        x = rng.randint(0, width)
+        y = rng.randint(0, height)
+        size = rng.randint(1, 5)
+        pygame.draw.circle(dead_end_img, WHITE, (x, y), size)
+        
+        # Add motion blur to small debris too
+        if size > 2:
+            blur_length = rng.randint(5, 15)
+            pygame.draw.line(dead_end_img, WHITE, 
                            (x, y), 
                            (x, y - blur_length), 
-                           size // 2)
-        
-        # Add dust and small debris
-        for _ in range(100):
-            x = random.randint(0, SCREEN_WIDTH)
-            y = random.randint(0, SCREEN_HEIGHT)
-            size = random.randint(1, 5)
-            pygame.draw.circle(dead_end_img, WHITE, (x, y), size)
-            
-            # Add motion blur to small debris too
-            if size > 2:
-                blur_length = random.randint(5, 15)
-                pygame.draw.line(dead_end_img, WHITE, 
-                               (x, y), 
-                               (x, y - blur_length), 
-                               1)
-        
-        # Add cracks in the ceiling
-        for _ in range(5):
-            start_x = random.randint(0, SCREEN_WIDTH)
-            start_y = random.randint(0, SCREEN_HEIGHT // 4)
-            
-            # Create a jagged line for the crack
-            points = [(start_x, start_y)]
-            for i in range(5):
-                points.append((
-                    points[-1][0] + random.randint(-30, 30),
-                    points[-1][1] + random.randint(10, 30)
-                ))
-            
-            # Draw the crack
-            pygame.draw.lines(dead_end_img, BLACK, False, points, 3)
-            
-            # Add some smaller cracks branching off
-            for point in points[1:-1]:
-                branch_length = random.randint(10, 30)
-                branch_end = (
-                    point[0] + random.randint(-branch_length, branch_length),
-                    point[1] + random.randint(-branch_length, branch_length)
-                )
-                pygame.draw.line(dead_end_img, BLACK, point, branch_end, 2)
-        
-        pygame.image.save(dead_end_img, dead_end_path)
-    
-    images['dead_end'] = pygame.image.load(dead_end_path)
-    
-    # Create or load torch image
-    torch_path = 'images/torch_pixel.png'
-    if not os.path.exists(torch_path):
-        torch_img = pygame.Surface((32, 48), pygame.SRCALPHA)
-        torch_img.fill((0, 0, 0, 0))
-        
-        # Draw torch handle
-        pygame.draw.rect(torch_img, BROWN, (14, 24, 4, 24))
-        
-        # Draw flame
-        pygame.draw.polygon(torch_img, (255, 100, 0), 
-                          [(10, 30), (16, 5), (22, 30)])
-        pygame.draw.polygon(torch_img, (255, 200, 0), 
-                          [(12, 30), (16, 10), (20, 30)])
-        
-        pygame.image.save(torch_img, torch_path)
-    
-    images['torch'] = pygame.image.load(torch_path)
-    
-    # Create arrow indicators for all three directions
-    arrow_paths = {}
-    arrow_directions = ['left', 'up', 'right']
-    
-    for direction in arrow_directions:
-        arrow_path = f'images/arrow_{direction}.png'
-        if not os.path.exists(arrow_path):
-            arrow_img = pygame.Surface((60, 40), pygame.SRCALPHA)
-            arrow_img.fill((0, 0, 0, 0))
-            
-            if direction == 'left':
-                # Draw left arrow
-                pygame.draw.polygon(arrow_img, (255, 255, 0), 
-                                  [(0, 20), (30, 0), (30, 10), (60, 10), (60, 30), (30, 30), (30, 40)])
-            elif direction == 'up':
-                # Draw up arrow
-                pygame.draw.polygon(arrow_img, (255, 255, 0), 
-                                  [(30, 0), (60, 30), (45, 30), (45, 40), (15, 40), (15, 30), (0, 30)])
-            elif direction == 'right':
-                # Draw right arrow
-                pygame.draw.polygon(arrow_img, (255, 255, 0), 
-                                  [(60, 20), (30, 0), (30, 10), (0, 10), (0, 30), (30, 30), (30, 40)])
-            
-            pygame.image.save(arrow_img, arrow_path)
+                           1)
+    
+    # Add cracks in the ceiling
+    for _ in range(5):
+        start_x = rng.randint(0, width)
+        start_y = rng.randint(0, height // 4)
         
-        arrow_paths[direction] = arrow_path
+        # Create a jagged line for the crack
+        points = [(start_x, start_y)]
+        for i in range(5):
+            points.append((
+                points[-1][0] + rng.randint(-30, 30),
+                points[-1][1] + rng.randint(10, 30)
+            ))
+        
+        # Draw the crack
+        pygame.draw.lines(dead_end_img, BLACK, False, points, 3)
+        
+        # Add some smaller cracks branching off
+        for point in points[1:-1]:
+            branch_length = rng.randint(10, 30)
+            branch_end = (
+                point[0] + rng.randint(-branch_length, branch_length),
+                point[1] + rng.randint(-branch_length, branch_length)
+            )
+            pygame.draw.line(dead_end_img, BLACK, point, branch_end, 2)
+    
+    return dead_end_img
+
+def generate_torch_image(params, rng):
+    torch_img = pygame.Surface(params["size"], pygame.SRCALPHA)
+    torch_img.fill((0, 0, 0, 0))
     
-    images['arrow_left'] = pygame.image.load(arrow_paths['left'])
-    images['arrow_up'] = pygame.image.load(arrow_paths['up'])
-    images['arrow_right'] = pygame.image.load(arrow_paths['right'])
+    # Draw torch handle
+    pygame.draw.rect(torch_img, BROWN, (14, 24, 4, 24))
     
-    return images
+    # Draw flame
+    pygame.draw.polygon(torch_img, (255, 100, 0), 
+                      [(10, 30), (16, 5), (22, 30)])
+    pygame.draw.polygon(torch_img, (255, 200, 0), 
+                      [(12, 30), (16, 10), (20, 30)])
+    
+    return torch_img
 
-# Game class
-class Game:
+def generate_arrow_image(params, rng):
+    arrow_img = pygame.Surface(params["size"], pygame.SRCALPHA)
+    arrow_img.fill((0, 0, 0, 0))
+    
+    direction = params["direction"]
+    if direction == 'left':
+        # Draw left arrow
+        pygame.draw.polygon(arrow_img, (255, 255, 0), 
+                          [(0, 20), (30, 0), (30, 10), (60, 10), (60, 30), (30, 30), (30, 40)])
+    elif direction == 'up':
+        # Draw up arrow
+        pygame.draw.polygon(arrow_img, (255, 255, 0), 
+                          [(30, 0), (60, 30), (45, 30), (45, 40), (15, 40), (15, 30), (0, 30)])
+    elif direction == 'right':
+        # Draw right arrow
+        pygame.draw.polygon(arrow_img, (255, 255, 0), 
+                          [(60, 20), (30, 0), (30, 10), (0, 10), (0, 30), (30, 30), (30, 40)])
+    
+    return arrow_img
+
+# name -> (file name, generator, parameters). The manifest records a hash of
+# each asset's file name, parameters and generator source; an asset is rebuilt
+# when that hash changes or its file is missing. The colors a generator draws
+# with are listed so that recoloring the game rebuilds its art too
+ASSETS = {
+    'treasure': ('treasure_chest_shining.png', generate_treasure_image,
+                 {"size": (SCREEN_WIDTH, SCREEN_HEIGHT),
+                  "colors": [CAVE_DARK, CAVE_FLOOR, BROWN, DARK_BROWN, GOLD, WHITE]}),
+    'trap': ('trap_approaching_spikes.png', generate_trap_image,
+             {"size": (SCREEN_WIDTH, SCREEN_HEIGHT), "colors": [CAVE_DARK, CAVE_FLOOR, GRAY, WHITE]}),
+    'dead_end': ('dead_end_falling_rocks.png', generate_dead_end_image,
+                 {"size": (SCREEN_WIDTH, SCREEN_HEIGHT),
+                  "colors": [CAVE_DARK, CAVE_FLOOR, GRAY, DARK_BROWN, WHITE, BLACK]}),
+    'torch': ('torch_pixel.png', generate_torch_image, {"size": (32, 48), "colors": [BROWN]}),
+    'arrow_left': ('arrow_left.png', generate_arrow_image, {"size": (60, 40), "direction": "left"}),
+    'arrow_up': ('arrow_up.png', generate_arrow_image, {"size": (60, 40), "direction": "up"}),
+    'arrow_right': ('arrow_right.png', generate_arrow_image, {"size": (60, 40), "direction": "right"}),
+}
+
+def asset_hash(name):
+    filename, generator, params = ASSETS[name]
+    try:
+        source = inspect.getsource(generator)
+    except (OSError, TypeError):
+        source = generator.__name__
+    content = json.dumps([filename, params], sort_keys=True) + source
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def build_asset(name, image_dir=IMAGE_DIR):
+    # Generate one asset and save it to disk; runs in a worker process when
+    # several assets are stale. Returns (name, hash, milliseconds taken)
+    start = time.perf_counter()
+    filename, generator, params = ASSETS[name]
+    digest = asset_hash(name)
+    image = generator(params, random.Random(digest))
+    pygame.image.save(image, os.path.join(image_dir, filename))
+    return name, digest, (time.perf_counter() - start) * 1000
+
+def read_manifest(image_dir=IMAGE_DIR):
+    try:
+        with open(os.path.join(image_dir, ASSET_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def build_assets(image_dir=IMAGE_DIR, workers=ASSET_BUILD_WORKERS):
+    # Bring the generated images up to date with their generators. Only stale
+    # assets are rebuilt, spread over a process pool when there are several.
+    # Entry points call this once at startup, before any Game is created.
+    # Returns name -> {"hash", "built", "build_ms"} (build_ms is None for
+    # assets that were already up to date)
+    os.makedirs(image_dir, exist_ok=True)
+    manifest = read_manifest(image_dir)
+    report = {}
+    stale = []
+    for name, (filename, generator, params) in ASSETS.items():
+        digest = asset_hash(name)
+        entry = manifest.get(name, {})
+        if entry.get("hash") == digest and os.path.exists(os.path.join(image_dir, filename)):
+            report[name] = {"hash": digest, "built": False, "build_ms": None}
+        else:
+            stale.append(name)
+    
+    if not stale:
+        return report
+    
+    if workers > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(min(workers, len(stale))) as pool:
+            results = list(pool.map(build_asset, stale, [image_dir] * len(stale)))
+    else:
+        results = [build_asset(name, image_dir) for name in stale]
+    for name, digest, ms in results:
+        report[name] = {"hash": digest, "built": True, "build_ms": round(ms, 3)}
+    
+    # The manifest keeps ASSETS order and nothing machine-specific (such as
+    # build times), so a rebuild only changes the hashes of rebuilt images
+    manifest = {name: {"file": ASSETS[name][0], "hash": report[name]["hash"]} for name in ASSETS}
+    with open(os.path.join(image_dir, ASSET_MANIFEST), 'w') as f:
+        f.write(json.dumps(manifest, indent=2) + "\n")
+    return report
+
+# Generated images, decoded on first use and converted to the display's pixel
+# format so blits need no per-pixel conversion. Counts uses of each image so
+# the game can tell which assets it actually needs
+class AssetRegistry:
+    def __init__(self, image_dir=IMAGE_DIR, report=None):
+        self.image_dir = image_dir
+        self.report = report if report is not None else {}  # Gets load_ms per image
+        self.images = {}
+        self.converted = set()
+        self.uses = dict.fromkeys(ASSETS, 0)
+    
+    def __getitem__(self, name):
+        self.uses[name] += 1
+        image = self.images.get(name)
+        if image is None:
+            start = time.perf_counter()
+            image = surface_pool.adopt(pygame.image.load(os.path.join(self.image_dir, ASSETS[name][0])))
+            self.images[name] = image
+            self.report.setdefault(name, {})["load_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        
+        # Converting needs a display mode; headless renders keep the file's format
+        if name not in self.converted and pygame.display.get_surface() is not None:
+            if image.get_flags() & pygame.SRCALPHA:
+                image = surface_pool.adopt(image.convert_alpha())
+            else:
+                image = surface_pool.adopt(image.convert())
+            self.images[name] = image
+            self.converted.add(name)
+        return image
+    
+    def usage(self):
+        # name -> whether it was loaded, how often it was drawn and its pixel memory
+        report = {}
+        for name, uses in self.uses.items():
+            image = self.images.get(name)
+            report[name] = {
+                "loaded": image is not None,
+                "uses": uses,
+                "bytes": image.get_pitch() * image.get_height() if image is not None else 0,
+            }
+        return report
+
+# Tileable cave texture of TEXTURE_BLOCKS x TEXTURE_BLOCKS pixel art blocks at
+# one real pixel per block: the old checkerboard pattern (squares of `checker`
+# blocks, every other one darkened by `shade`) plus smooth value noise. The
+# noise sums octaves of random lattices that wrap around at the texture edge,
+# so copies of the texture tile without seams. Built in one NumPy pass
+def generate_cave_texture(base_color, checker, shade, rng, periods=(4, 8, 16)):
+    size = TEXTURE_BLOCKS
+    blocks = numpy.arange(size)
+    noise = numpy.zeros((size, size))
+    amplitude = 1.0
+    total_amplitude = 0.0
+    for period in periods:
+        lattice = numpy.array([[rng.uniform(-1, 1) for _ in range(period)] for _ in range(period)])
+        position = blocks * period / size
+        low = position.astype(int)
+        high = (low + 1) % period
+        t = position - low
+        t = t * t * (3 - 2 * t)  # Smoothstep between lattice points
+        tx = t[:, None]
+        ty = t[None, :]
+        top = lattice[low][:, low] * (1 - tx) + lattice[high][:, low] * tx
+        bottom = lattice[low][:, high] * (1 - tx) + lattice[high][:, high] * tx
+        noise += amplitude * (top * (1 - ty) + bottom * ty)
+        total_amplitude += amplitude
+        amplitude /= 2
+    noise /= total_amplitude  # Back to -1..1
+    
+    # Array indices are [x, y] like surfarray
+    checkerboard = (blocks[:, None] // checker + blocks[None, :] // checker) % 2
+    brightness = numpy.round(noise * TEXTURE_CONTRAST / 4) * 4 - checkerboard * shade
+    pixels = numpy.clip(numpy.array(base_color)[None, None, :] + brightness[:, :, None], 0, 255)
+    return surface_pool.adopt(pygame.surfarray.make_surface(pixels.astype(numpy.uint8)))
+
+# A texture repeated over a Surface of the given size
+def tile_texture(texture, size):
+    surface = surface_pool.create(size)
+    width, height = texture.get_size()
+    for y in range(0, size[1], height):
+        for x in range(0, size[0], width):
+            surface.blit(texture, (x, y))
+    return surface
+
+# Small LRU cache of pre-rendered layers
+class LayerCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.layers = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, build):
+        # Return the layer stored under key, building (and caching) it if needed
+        layer = self.layers.get(key)
+        if layer is not None:
+            self.hits += 1
+            self.layers.move_to_end(key)
+            return layer
+        
+        self.misses += 1
+        layer = build()
+        self.layers[key] = layer
+        if len(self.layers) > self.max_size:
+            self.layers.popitem(last=False)  # Evict the least recently used layer
+        return layer
+    
+    def clear(self):
+        self.layers.clear()
+
+# Fonts loaded once per size and rendered text kept in an LRU
+class TextCache:
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.fonts = {}
+        self.rendered = LayerCache(max_size)
+    
+    def font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            font = pygame.font.SysFont(None, size)
+            self.fonts[size] = font
+        return font
+    
+    def render(self, text, size, color):
+        # Antialiased text Surface for (text, size, color), rendered on first use
+        return self.rendered.get((text, size, color),
+                                 lambda: surface_pool.adopt(self.font(size).render(text, True, color)))
+    
+    def prewarm(self, entries):
+        # Render (text, size, color) entries ahead of time so the first frame
+        # that shows them doesn't have to
+        for text, size, color in entries:
+            self.render(text, size, color)
+
+# Rasterize a convex polygon onto the PIXEL_SIZE grid, yielding (x, y, width)
+# for every row of blocks it covers. A block is covered when its center lies
+# inside the polygon, so polygons sharing an edge tile without gaps or overlap.
+# Each row's span comes straight from its edge crossings, so the cost grows with
+# the number of rows, not the number of blocks
+def polygon_spans(points):
+    half = PIXEL_SIZE / 2
+    
+    # (top, bottom, x, y, slope) of every edge that is not horizontal
+    edges = [(min(y0, y1), max(y0, y1), x0, y0, (x1 - x0) / (y1 - y0))
+             for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]) if y0 != y1]
+    ys = [y for x, y in points]
+    
+    for row in range(math.ceil((min(ys) - half) / PIXEL_SIZE), math.ceil((max(ys) - half) / PIXEL_SIZE)):
+        y = row * PIXEL_SIZE
+        center = y + half
+        crossings = [x + (center - y0) * slope for top, bottom, x, y0, slope in edges if top <= center < bottom]
+        if len(crossings) < 2:
+            continue
+        
+        first = math.ceil((min(crossings) - half) / PIXEL_SIZE)
+        end = math.ceil((max(crossings) - half) / PIXEL_SIZE)
+        if end > first:
+            yield first * PIXEL_SIZE, y, (end - first) * PIXEL_SIZE
+
+# Edges of a tunnel segment along one axis, tiled with blocks of the given size
+# from start up to end. Blocks within two PIXEL_SIZE of either end form the
+# border; returns (start, inner start, inner end, end of the last block), with
+# inner start == inner end when the border covers every block
+def segment_edges(start, end, block):
+    outer_end = start + len(range(start, end, block)) * block
+    inner_start = start + math.ceil(PIXEL_SIZE * 2 / block) * block
+    inner_end = inner_start + len(range(inner_start, end - PIXEL_SIZE * 3 + 1, block)) * block
+    return start, inner_start, inner_end, outer_end
+
+# A pixel-art shape as PIXEL_SIZE blocks (dx, dy, color, clipped) relative to an
+# anchor point. Clipped blocks are skipped when they start off-screen along the
+# clip axes; shapes whose clipped blocks are all on-screen are drawn as sprites
+class CellShape:
+    def __init__(self, cells, clip_x, clip_y):
+        self.cells = cells
+        self.clip_x = clip_x
+        self.clip_y = clip_y
+        self.sprite = None  # Built on first use, see Game.shape_sprite
+        
+        # Bounding box of all blocks, and of the clipped ones
+        xs = [dx for dx, dy, color, clipped in cells] or [0]
+        ys = [dy for dx, dy, color, clipped in cells] or [0]
+        self.left, self.top = min(xs), min(ys)
+        self.right, self.bottom = max(xs) + PIXEL_SIZE, max(ys) + PIXEL_SIZE
+        clipped_xs = [dx for dx, dy, color, clipped in cells if clipped] or [0]
+        clipped_ys = [dy for dx, dy, color, clipped in cells if clipped] or [0]
+        self.clip_box = (min(clipped_xs), max(clipped_xs), min(clipped_ys), max(clipped_ys))
+    
+    def fits(self, x, y):
+        # True when no clipped block would start off-screen at anchor (x, y)
+        min_dx, max_dx, min_dy, max_dy = self.clip_box
+        if self.clip_x and not (0 <= x + min_dx and x + max_dx < SCREEN_WIDTH):
+            return False
+        if self.clip_y and not (0 <= y + min_dy and y + max_dy < SCREEN_HEIGHT):
+            return False
+        return True
+
+# Records the rectangle fills drawn on one Surface and submits them with as
+# few Surface.fill calls as possible: fills that continue a row in the same
+# color become one span, and spans stacked exactly under one another become one
+# rect. Spans are only stacked while fills arrive in scanline order (left to
+# right along a row of equal height, rows top to bottom), where every fill
+# recorded in between is disjoint from them, so the merged fills paint the same
+# pixels as the recorded ones in their order
+class FillBuffer:
+    def __init__(self, surface):
+        self.surface = surface
+        self.rects = []  # [color, x, y, width, height] in submission order
+        self.pending = None  # Span still growing along the current row
+        self.stacks = {}  # (color, x, width) -> rect that may grow downwards
+        self.last_span = None
+    
+    def fill(self, color, x, y, width, height):
+        # Called once per block, so the common case of continuing the pending
+        # span is kept to a few comparisons
+        span = self.pending
+        if span is not None:
+            if span[1] + span[3] == x and span[2] == y and span[4] == height and span[0] == color:
+                span[3] += width
+                return
+            self.commit(span)
+        self.pending = [color, x, y, width, height]
+    
+    def commit(self, span):
+        color, x, y, width, height = span
+        last = self.last_span
+        self.last_span = span
+        in_order = (last is None or y >= last[2] + last[4] or
+                    (y == last[2] and height == last[4] and x >= last[1] + last[3]))
+        if not in_order:
+            self.stacks.clear()
+        else:
+            rect = self.stacks.get((color, x, width))
+            if rect is not None and rect[2] + rect[4] == y:
+                rect[4] += height
+                return
+        
+        rect = list(span)
+        self.rects.append(rect)
+        self.stacks[(color, x, width)] = rect
+    
+    def flush(self):
+        # Submit everything recorded so far and return the number of fills
+        if self.pending is not None:
+            self.commit(self.pending)
+            self.pending = None
+        
+        fill = self.surface.fill
+        for color, x, y, width, height in self.rects:
+            fill(color, (x, y, width, height))
+        count = len(self.rects)
+        self.rects = []
+        self.stacks.clear()
+        self.last_span = None
+        return count
+
+# A set of particles as a struct of arrays: screen positions, sizes in blocks,
+# colors and lifetimes (how far through its life each particle is, from 0 to
+# 1), one NumPy array each, so whole sets are moved with vectorized math. All
+# particles of a set share a shape ("square" blocks or "sparkle" crosses) and
+# are drawn in one Surface.blits batch (see Game.draw_particles)
+class Particles:
+    def __init__(self, x, y, size, color, shape="square", life=0.0):
+        self.x = numpy.asarray(x).astype(int)
+        self.y = numpy.asarray(y).astype(int)
+        self.size = numpy.broadcast_to(numpy.asarray(size).astype(int), self.x.shape)
+        self.color = numpy.broadcast_to(numpy.asarray(color).astype(int), self.x.shape + (3,))
+        self.life = numpy.broadcast_to(numpy.asarray(life, dtype=float), self.x.shape)
+        self.shape = shape
+    
+    def __len__(self):
+        return len(self.x)
+
+# Precomputed light maps for the torch flicker and the selected-path glow
+class LightMaps:
+    def __init__(self, additive=False):
+        # Alpha blending darkens nothing and reproduces the original look;
+        # additive blending brightens whatever is under the light instead
+        self.additive = additive
+        
+        # One torch light per possible flicker radius (the flicker phase only
+        # ever selects one of these)
+        self.torch_frames = {}
+        for size in range(TORCH_LIGHT_RADIUS, TORCH_LIGHT_RADIUS + 11):
+            light = surface_pool.create((size*2, size*2), pygame.SRCALPHA)
+            for radius in range(size, 0, -10):
+                alpha = max(0, 100 - radius)
+                pygame.draw.circle(light, (255, 200, 100, alpha), (size, size), radius)
+            self.torch_frames[size] = self.prepare(light)
+        
+        # Glow sprite drawn under the arrow of the selected path
+        glow = surface_pool.create((GLOW_RADIUS*2 + 1, GLOW_RADIUS*2 + 1), pygame.SRCALPHA)
+        for radius in range(GLOW_RADIUS, 0, -5):
+            alpha = max(0, 50 - radius)
+            pygame.draw.circle(glow, (255, 255, 100, alpha), (GLOW_RADIUS, GLOW_RADIUS), radius)
+        self.glow = self.prepare(glow)
+    
+    def prepare(self, light):
+        # Additive lights are stored premultiplied so their alpha scales the color
+        return surface_pool.adopt(light.premul_alpha()) if self.additive else light
+    
+    def blit(self, surface, light, pos):
+        # Returns the rectangle that was lit
+        if self.additive:
+            return surface.blit(light, pos, special_flags=pygame.BLEND_RGB_ADD)
+        return surface.blit(light, pos)
+    
+    def torch_radius(self, phase):
+        return TORCH_LIGHT_RADIUS + int(10 * abs(math.sin(phase)))
+    
+    def draw_torch_light(self, surface, torch_pos, phase):
+        # Light centered on the flame of a torch sprite drawn at torch_pos
+        size = self.torch_radius(phase)
+        return self.blit(surface, self.torch_frames[size], (torch_pos[0] - size + 15, torch_pos[1] - size + 15))
+    
+    def draw_glow(self, surface, center):
+        return self.blit(surface, self.glow, (center[0] - GLOW_RADIUS, center[1] - GLOW_RADIUS))
+
+# Creates the Surfaces the game allocates while running and keeps count of
+# their bytes, so the profiler can charge them to the stage that made them.
+# Surfaces that pygame makes itself (rendered text, loaded and converted
+# images, premultiplied copies) are counted by handing them to adopt().
+# Short-lived scratch Surfaces are borrowed and given back instead, and reused
+# by (size, flags) rather than allocated again every time
+class SurfacePool:
     def __init__(self):
-        self.images = load_images()
+        self.free = {}  # (size, flags) -> Surfaces given back
+        self.allocated_bytes = 0  # Pixel bytes of every Surface created so far
+        self.created = 0
+        self.reused = 0
+    
+    def create(self, size, flags=0, *depth):
+        # A new Surface that is kept by the caller (e.g. in a cache)
+        return self.adopt(pygame.Surface(size, flags, *depth))
+    
+    def adopt(self, surface):
+        # Count a Surface created elsewhere, e.g. by Font.render, and return it
+        self.allocated_bytes += surface.get_pitch() * surface.get_height()
+        self.created += 1
+        return surface
+    
+    @contextmanager
+    def borrow(self, size, flags=0):
+        # Use as `with surface_pool.borrow(size) as scratch: ...`. The contents
+        # are left over from the last borrower, so clear what you use
+        free = self.free.setdefault((tuple(size), flags), [])
+        if free:
+            surface = free.pop()
+            self.reused += 1
+        else:
+            surface = self.create(size, flags)
+        try:
+            yield surface
+        finally:
+            free.append(surface)
+
+# Surfaces of this process
+surface_pool = SurfacePool()
+
+# Timing of one profiled stage; created only while the profiler is enabled.
+# With allocation tracking it also measures the most Python memory the stage
+# had allocated at once and the Surface bytes it created. Stages are not
+# nested, so each one can reset the tracemalloc peak for itself
+class ProfiledStage:
+    __slots__ = ('profiler', 'name', 'start', 'calls', 'memory', 'surface_bytes')
+    
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+    
+    def __enter__(self):
+        if self.profiler.track_allocations:
+            tracemalloc.reset_peak()
+            self.memory = tracemalloc.get_traced_memory()[0]
+            self.surface_bytes = surface_pool.allocated_bytes
+        self.calls = self.profiler.draw_calls()
+        self.start = time.perf_counter()
+    
+    def __exit__(self, *exc):
+        elapsed = (time.perf_counter() - self.start) * 1000
+        calls = self.profiler.draw_calls() - self.calls
+        if self.profiler.track_allocations:
+            allocated = tracemalloc.get_traced_memory()[1] - self.memory
+            self.profiler.record(self.name, elapsed, calls, allocated, surface_pool.allocated_bytes - self.surface_bytes)
+        else:
+            self.profiler.record(self.name, elapsed, calls)
+
+# Per-stage frame timing with an on-screen overlay and JSON-lines export
+class FrameProfiler:
+    # Shared no-op context returned while profiling is off
+    DISABLED = nullcontext()
+    
+    def __init__(self, enabled=False, log_path=None, window=PROFILE_WINDOW, track_allocations=False):
+        self.enabled = enabled or log_path is not None
+        self.show_overlay = enabled
+        self.window = window
+        self.counter = None  # Object whose draw_calls attribute is sampled per stage
+        self.frame_stages = {}  # name -> [ms, draw calls, Python bytes, Surface bytes] for the current frame
+        
+        # Garbage collections and their pause time during the current frame
+        self.track_allocations = track_allocations
+        self.gc_collections = 0
+        self.gc_ms = 0.0
+        self.gc_start = None
+        if track_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            gc.callbacks.append(self.on_gc)
+        self.history = {}  # name -> recent per-frame ms, for the overlay
+        self.last_frame = {}
+        self.last_quality = None
+        self.last_counters = None
+        self.frame_number = 0
+        self.font = None
+        self.log_file = open(log_path, 'a') if log_path else None
+    
+    @classmethod
+    def from_environment(cls):
+        log_path = os.environ.get('CAVE_PROFILE_LOG') or None
+        return cls(enabled=os.environ.get('CAVE_PROFILE', '0') == '1', log_path=log_path,
+                   track_allocations=TRACK_ALLOCATIONS)
+    
+    def on_gc(self, phase, info):
+        if phase == "start":
+            self.gc_start = time.perf_counter()
+        elif self.gc_start is not None:
+            self.gc_collections += 1
+            self.gc_ms += (time.perf_counter() - self.gc_start) * 1000
+            self.gc_start = None
+    
+    def toggle(self):
+        # The hotkey flips the overlay; logging stays on if a log file is open
+        self.show_overlay = not self.show_overlay
+        self.enabled = self.show_overlay or self.log_file is not None
+        self.frame_stages = {}
+    
+    def stage(self, name):
+        # Use as `with profiler.stage("update"): ...`
+        if not self.enabled:
+            return self.DISABLED
+        return ProfiledStage(self, name)
+    
+    def draw_calls(self):
+        return self.counter.draw_calls if self.counter is not None else 0
+    
+    def record(self, name, ms, calls, python_bytes=0, surface_bytes=0):
+        # A stage may run several times per frame; its times, calls and
+        # allocations add up
+        totals = self.frame_stages.get(name)
+        if totals is None:
+            self.frame_stages[name] = [ms, calls, python_bytes, surface_bytes]
+        else:
+            totals[0] += ms
+            totals[1] += calls
+            totals[2] += python_bytes
+            totals[3] += surface_bytes
+    
+    def record_startup(self, assets, total_ms):
+        # Asset build times go into the log ahead of the first frame
+        if self.log_file:
+            record = {"startup": {"total_ms": round(total_ms, 3), "assets": assets}}
+            self.log_file.write(json.dumps(record) + "\n")
+    
+    def record_asset_usage(self, usage):
+        # Which images the session actually drew, written when the game exits
+        if self.log_file:
+            self.log_file.write(json.dumps({"assets": usage}) + "\n")
+    
+    def end_frame(self, state, quality=None, counters=None):
+        # counters: running totals of the caches and pools (see Game.counters)
+        if not self.enabled:
+            return
+        
+        self.frame_number += 1
+        for name, (ms, *_) in self.frame_stages.items():
+            if name not in self.history:
+                self.history[name] = deque(maxlen=self.window)
+            self.history[name].append(ms)
+        
+        if self.log_file:
+            record = {
+                "frame": self.frame_number,
+                "state": state,
+                "quality": quality,
+                "total_ms": round(sum(ms for ms, *_ in self.frame_stages.values()), 3),
+                "stages": {name: {"ms": round(ms, 3), "draw_calls": calls}
+                           for name, (ms, calls, *_) in self.frame_stages.items()},
+            }
+            if self.track_allocations:
+                for name, (ms, calls, python_bytes, surface_bytes) in self.frame_stages.items():
+                    record["stages"][name].update(alloc_bytes=python_bytes, surface_bytes=surface_bytes)
+                record["gc"] = {"collections": self.gc_collections, "ms": round(self.gc_ms, 3)}
+            if counters is not None:
+                record["counters"] = counters
+            self.log_file.write(json.dumps(record) + "\n")
+        
+        self.last_frame = self.frame_stages
+        self.last_quality = quality
+        self.last_counters = counters
+        self.frame_stages = {}
+        self.gc_collections = 0
+        self.gc_ms = 0.0
+    
+    def draw_overlay(self, surface):
+        # Rolling average ms per stage of the last frame, as bars where the full
+        # bar width is one frame at the target FPS. Returns the area drawn over
+        if not self.show_overlay or not self.last_frame:
+            return None
+        if self.font is None:
+            self.font = pygame.font.SysFont(None, 18)
+        
+        bar_width = 120
+        row_height = 16
+        rows = len(self.last_frame) + len(self.status_lines())
+        with surface_pool.borrow((460, row_height * rows + 8), pygame.SRCALPHA) as panel:
+            return surface.blit(self.draw_panel(panel, bar_width, row_height), (8, 8))
+    
+    def draw_panel(self, panel, bar_width, row_height):
+        budget_ms = 1000 / FPS
+        panel.fill((0, 0, 0, 170))
+        
+        for row, (name, (ms, calls, python_bytes, surface_bytes)) in enumerate(self.last_frame.items()):
+            history = self.history[name]
+            average = sum(history) / len(history)
+            y = 4 + row * row_height
+            width = min(bar_width, int(bar_width * average / budget_ms))
+            color = GREEN if average < budget_ms / 4 else GOLD if average < budget_ms / 2 else RED
+            pygame.draw.rect(panel, color, (4, y + 3, max(1, width), row_height - 6))
+            text = f"{name}  {average:.2f} ms  {calls} calls"
+            if self.track_allocations:
+                text += f"  {(python_bytes + surface_bytes) / 1024:.0f} kB"
+            label = surface_pool.adopt(self.font.render(text, True, WHITE))
+            panel.blit(label, (bar_width + 10, y + 2))
+        
+        for row, text in enumerate(self.status_lines(), len(self.last_frame)):
+            label = surface_pool.adopt(self.font.render(text, True, WHITE))
+            panel.blit(label, (bar_width + 10, 4 + row * row_height + 2))
+        return panel
+    
+    def status_lines(self):
+        # Quality level and cache/pool counters shown under the stage bars
+        lines = []
+        counters = self.last_counters or {}
+        if self.last_quality is not None:
+            changes = counters.get("quality_changes")
+            lines.append(f"quality level {self.last_quality}" +
+                         (f"  {changes} changes" if changes is not None else ""))
+        if "surfaces" in counters:
+            surfaces = counters["surfaces"]
+            lines.append(f"surfaces  {surfaces['created']} created  {surfaces['reused']} reused")
+        for name, cache in counters.get("caches", {}).items():
+            lines.append(f"{name}  {cache['hits']} hits  {cache['misses']} misses")
+        return lines
+    
+    def close(self):
+        if self.on_gc in gc.callbacks:
+            gc.callbacks.remove(self.on_gc)
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+
+# Frame times of one game state in fixed-width buckets, so memory stays
+# constant however long the game runs. Percentiles are read off the buckets
+# (to HISTOGRAM_BUCKET_MS); the maximum is kept exactly
+class FrameHistogram:
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.frames = 0
+        self.over_budget = 0
+        self.max_ms = 0.0
+    
+    def add(self, ms, budget_ms):
+        self.counts[min(HISTOGRAM_BUCKETS - 1, int(ms / HISTOGRAM_BUCKET_MS))] += 1
+        self.frames += 1
+        self.max_ms = max(self.max_ms, ms)
+        if ms > budget_ms + OVER_BUDGET_SLACK_MS:
+            self.over_budget += 1
+    
+    def percentile(self, fraction):
+        # Upper edge of the bucket holding the given fraction of frames
+        wanted = fraction * self.frames
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted and count:
+                return round(min(self.max_ms, (bucket + 1) * HISTOGRAM_BUCKET_MS), 3)
+        return round(self.max_ms, 3)
+    
+    def summary(self):
+        return {
+            "frames": self.frames,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "over_budget": self.over_budget,
+        }
+
+# Frame-time telemetry of a whole session: a FrameHistogram per game state, a
+# jank line for every frame over JANK_FACTOR budgets, and a snapshot of all
+# histograms every interval seconds. Lines are appended as JSON, so one file
+# collects many sessions to compare over days
+class FrameStats:
+    def __init__(self, path=None, budget_ms=1000 / FPS, interval=STATS_INTERVAL):
+        self.path = path
+        self.budget_ms = budget_ms
+        self.interval = interval
+        self.histograms = {}  # state -> FrameHistogram
+        self.janks = 0
+        
+        # Input-to-display latency of key presses: from the poll that read the
+        # key to the end of the flip showing it, and from the poll before that.
+        # The key arrived in between, so the two bound its real latency
+        self.latency = FrameHistogram()
+        self.latency_bound = FrameHistogram()
+        self.low_latency = LOW_LATENCY
+        
+        # Pixels the Presenter uploaded, to see what dirty-rect mode saves
+        self.dirty_rects = DIRTY_RECT_PRESENTATION
+        self.presented_frames = 0
+        self.presented_pixels = 0
+        self.full_presents = 0
+        self.last_state = None
+        self.started = time.time()
+        self.next_snapshot = time.perf_counter() + interval
+    
+    @classmethod
+    def from_environment(cls):
+        return cls(FRAME_STATS_PATH)
+    
+    def record(self, ms, state, effect=None):
+        # One frame of ms milliseconds that ended in state. effect is the
+        # transition effect playing, if any
+        histogram = self.histograms.get(state)
+        if histogram is None:
+            histogram = self.histograms[state] = FrameHistogram()
+        histogram.add(ms, self.budget_ms)
+        
+        if ms > self.budget_ms * JANK_FACTOR:
+            self.janks += 1
+            if state != self.last_state and self.last_state is not None:
+                transition = "%s->%s" % (self.last_state, state)
+            else:
+                transition = effect
+            self.write({"jank": {"time": round(time.time(), 3), "ms": round(ms, 3), "state": state,
+                                 "transition": transition}})
+        self.last_state = state
+        
+        if time.perf_counter() >= self.next_snapshot:
+            self.snapshot()
+    
+    def record_latency(self, from_poll_ms, from_previous_poll_ms):
+        self.latency.add(from_poll_ms, self.budget_ms)
+        self.latency_bound.add(from_previous_poll_ms, self.budget_ms)
+    
+    def record_presented(self, area):
+        # Pixels uploaded to show one frame (Presenter.presented_area)
+        self.presented_frames += 1
+        self.presented_pixels += area
+        if area >= SCREEN_WIDTH * SCREEN_HEIGHT:
+            self.full_presents += 1
+    
+    def summary(self):
+        summary = {
+            "started": round(self.started, 3),
+            "time": round(time.time(), 3),
+            "budget_ms": round(self.budget_ms, 3),
+            "janks": self.janks,
+            "states": {state: histogram.summary() for state, histogram in self.histograms.items()},
+        }
+        if self.latency.frames:
+            summary["latency"] = {
+                "low_latency": self.low_latency,
+                "from_poll": self.latency.summary(),
+                "from_previous_poll": self.latency_bound.summary(),
+            }
+        if self.presented_frames:
+            screen_pixels = self.presented_frames * SCREEN_WIDTH * SCREEN_HEIGHT
+            summary["presented"] = {
+                "dirty_rects": self.dirty_rects,
+                "frames": self.presented_frames,
+                "full_frames": self.full_presents,
+                "screen_fraction": round(self.presented_pixels / screen_pixels, 4),
+            }
+        return summary
+    
+    def snapshot(self):
+        self.next_snapshot = time.perf_counter() + self.interval
+        self.write({"snapshot": self.summary()})
+    
+    def write(self, record):
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+    
+    def close(self):
+        # Final snapshot covering the whole session
+        if self.histograms:
+            self.snapshot()
+
+# Sleep until the perf_counter() time target, spinning through the last
+# SLEEP_SLACK_SECONDS so an oversleep cannot make the frame late
+def wait_until(target):
+    remaining = target - time.perf_counter()
+    if remaining > SLEEP_SLACK_SECONDS:
+        time.sleep(remaining - SLEEP_SLACK_SECONDS)
+    while time.perf_counter() < target:
+        pass
+
+# Frame pacing of low-latency mode. Every frame has a deadline one budget
+# after the last; wait() returns when the slowest recent frame, plus a margin,
+# would just finish by it, so input is polled as late as possible
+class FramePacer:
+    def __init__(self, fps=FPS):
+        self.budget = 1 / fps
+        self.deadline = time.perf_counter()
+        self.work = deque(maxlen=RENDER_ESTIMATE_WINDOW)  # Recent frame times without the wait
+        self.work_start = self.deadline
+    
+    def wait(self):
+        # A frame that missed its deadline moves the following ones back
+        # rather than making them hurry to catch up
+        now = time.perf_counter()
+        self.deadline = max(self.deadline + self.budget, now)
+        wait_until(self.deadline - max(self.work, default=0) - LATENCY_MARGIN_SECONDS)
+        self.work_start = time.perf_counter()
+    
+    def frame_done(self):
+        # Returns the milliseconds the frame took since wait() returned
+        work = time.perf_counter() - self.work_start
+        self.work.append(work)
+        return work * 1000
+
+# Picks the quality level from recent frame times so frames fit the FPS
+# budget. Each game state keeps its own window of frame times, since one state
+# can cost many times another; a level is left when the state being drawn is too
+# slow at it, and only returned to when every state seen at the level has
+# headroom. Thresholds far apart, a full window of frames before a state is
+# judged, and an ever longer wait before returning to a level that was too slow
+# keep it from oscillating between two levels
+class QualityGovernor:
+    def __init__(self, level=QUALITY_LEVEL, budget_ms=1000 / FPS, window=QUALITY_WINDOW):
+        if level is not None and not 0 <= level < len(QUALITY_LEVELS):
+            raise ValueError("quality level must be from 0 to %d, not %r" % (len(QUALITY_LEVELS) - 1, level))
+        self.adaptive = level is None
+        self.level = level or 0
+        self.budget_ms = budget_ms
+        self.window = window
+        self.samples = {}  # state -> deque of its latest frame times at this level
+        self.frames_at_level = 0
+        self.too_slow = {}  # level -> times it had to be left for being too slow
+        self.changes = 0
+    
+    def density(self):
+        return QUALITY_LEVELS[self.level][0]
+    
+    def block_size(self):
+        return PIXEL_SIZE * QUALITY_LEVELS[self.level][1]
+    
+    def record(self, frame_ms, state):
+        # Milliseconds of work (not waiting) spent on the last frame, which
+        # drew the given game state
+        if not self.adaptive:
+            return
+        samples = self.samples.get(state)
+        if samples is None:
+            samples = self.samples[state] = deque(maxlen=self.window)
+        samples.append(frame_ms)
+        self.frames_at_level += 1
+        if len(samples) < self.window:
+            return
+        
+        if self.average(samples) > self.budget_ms * QUALITY_DOWNGRADE and self.level < len(QUALITY_LEVELS) - 1:
+            self.too_slow[self.level] = self.too_slow.get(self.level, 0) + 1
+            self.set_level(self.level + 1)
+        elif self.level > 0 and all(self.average(window) < self.budget_ms * QUALITY_UPGRADE
+                                    for window in self.samples.values()):
+            # Each time the better level proved too slow, wait twice as long
+            if self.frames_at_level >= self.window * 2 ** self.too_slow.get(self.level - 1, 0):
+                self.set_level(self.level - 1)
+    
+    def average(self, samples):
+        return sum(samples) / len(samples)
+    
+    def set_level(self, level):
+        self.level = level
+        self.changes += 1
+        self.frames_at_level = 0
+        self.samples.clear()  # Judge the new level on its own frames
+
+# Clock whose time only moves when it is advanced. The fixed-timestep loop
+# advances it one tick per update; tests and benchmarks can set or
+# fast-forward it directly
+class SimulationClock:
+    def __init__(self, start=0.0):
+        self.now = start
+    
+    def time(self):
+        return self.now
+    
+    def advance(self, seconds):
+        self.now += seconds
+
+# Runs the game simulation in fixed steps of TICK_SECONDS whatever the frame
+# rate: elapsed real time is accumulated and spent one tick at a time, and what
+# is left over is used to interpolate the frame drawn in between two ticks. At
+# most MAX_CATCH_UP_TICKS are run per frame, so after a stall the game slows
+# down briefly instead of spending ever longer catching up
+class FixedTimestep:
+    def __init__(self, game, tick=TICK_SECONDS, max_ticks=MAX_CATCH_UP_TICKS):
+        self.game = game
+        self.tick = tick
+        self.max_ticks = max_ticks
+        self.accumulator = 0.0
+        self.ticks = 0  # Ticks run so far
+    
+    def step(self):
+        # One simulation tick; the game's clock must be a SimulationClock
+        self.game.clock.advance(self.tick)
+        self.game.update()
+        self.ticks += 1
+    
+    def advance(self, elapsed):
+        # Spend elapsed seconds of real time and return the number of ticks run
+        self.accumulator = min(self.accumulator + elapsed, self.tick * self.max_ticks)
+        ticks = 0
+        while self.accumulator >= self.tick:
+            self.step()
+            self.accumulator -= self.tick
+            ticks += 1
+        self.game.set_interpolation(self.accumulator / self.tick)
+        return ticks
+
+# Writes the key presses of a session to a compact binary log: a header with
+# the session seed, then for every key in GAME_KEYS handed to Game.handle_key
+# the tick it arrived on and the interpolation of the frame on screen, which
+# together fix the time the game saw it. Replaying the log into a game with the same seed
+# on a SimulationClock reproduces the session exactly (see replay.py)
+class InputRecorder:
+    def __init__(self, path, seed):
+        self.file = open(path, 'wb')
+        self.file.write(INPUT_LOG_HEADER.pack(INPUT_LOG_MAGIC, INPUT_LOG_VERSION, seed))
+        self.events = 0
+    
+    def record(self, tick, alpha, key):
+        self.file.write(INPUT_LOG_EVENT.pack(tick, alpha, key))
+        self.events += 1
+    
+    def close(self, tick):
+        # End marker with the last tick run, so a replay runs just as long
+        self.file.write(INPUT_LOG_EVENT.pack(tick, 1.0, 0))
+        self.file.close()
+
+# Read a log written by InputRecorder. Returns the seed, the (tick, alpha, key)
+# events and the tick the session ended on (None if it was cut short)
+def read_input_log(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    
+    magic, version, seed = INPUT_LOG_HEADER.unpack_from(data)
+    if magic != INPUT_LOG_MAGIC or version != INPUT_LOG_VERSION:
+        raise ValueError("%s is not a version %d input log" % (path, INPUT_LOG_VERSION))
+    
+    events = []
+    end_tick = None
+    body = data[INPUT_LOG_HEADER.size:]
+    body = body[:len(body) - len(body) % INPUT_LOG_EVENT.size]
+    for tick, alpha, key in INPUT_LOG_EVENT.iter_unpack(body):
+        if key == 0:
+            end_tick = tick
+            break
+        events.append((tick, alpha, key))
+    return seed, events, end_tick
+
+# Shows finished frames, either with a full flip or, in dirty-rect mode, by
+# uploading only the regions that changed since the previous frame
+class Presenter:
+    def __init__(self, dirty_rects=DIRTY_RECT_PRESENTATION):
+        self.dirty_rects = dirty_rects
+        self.last_key = None
+        self.last_rects = []
+        self.force_full = True
+        self.presented_area = 0  # Pixels uploaded by the last present()
+    
+    def invalidate(self):
+        # Next frame goes out in full (e.g. after the window was uncovered)
+        self.force_full = True
+    
+    def present(self, game, extra_rects=()):
+        rects = game.frame_rects + [rect for rect in extra_rects if rect]
+        key = game.scene_key()
+        
+        if not self.dirty_rects or self.force_full or key is None or key != self.last_key:
+            # The scene under the sprites changed (or is animated): flip it all
+            pygame.display.flip()
+            self.presented_area = SCREEN_WIDTH * SCREEN_HEIGHT
+        else:
+            # Only the torch light changed. Regions drawn last frame are included
+            # so a light that shrank gets cleared too; the same light drawn in
+            # consecutive frames becomes one rectangle
+            if len(rects) == len(self.last_rects):
+                damaged = [rect.union(last) for rect, last in zip(rects, self.last_rects)]
+            else:
+                damaged = self.last_rects + rects
+            pygame.display.update(damaged)
+            self.presented_area = sum(rect.width * rect.height for rect in damaged)
+        
+        self.last_key = key
+        self.last_rects = rects
+        self.force_full = False
+
+# The rules of the game as a pure state machine: no pygame, drawing or clock.
+# Times are passed in by the caller and randomness comes from rng (the random
+# module by default, or a random.Random), so games can be simulated headless
+# and in bulk (see simulate.py). Game adds key presses, its clock and drawing
+class GameRules:
+    def __init__(self, rng=random, paths=len(PATH_CENTERS), win_streak=WIN_STREAK, trap_chance=TRAP_CHANCE):
+        self.rng = rng
+        self.paths = paths
+        self.win_streak = win_streak
+        self.trap_chance = trap_chance
+        self.transition_duration = TRANSITION_SECONDS
+        self.transition_time = 0
         self.state = "playing"  # playing, success, trap, dead_end, victory
-        self.correct_path = random.randint(0, 2)  # 0: left, 1: middle, 2: right
+        self.correct_path = rng.randrange(paths)  # 0: left, 1: middle, 2: right
         self.selected_path = 1  # Default to middle
         self.success_count = 0
-        self.transition_time = 0
-        self.transition_duration = 1.0  # seconds
+    
+    def finished(self):
+        # True once the game is over and can only be restarted
+        return self.state in ("trap", "dead_end", "victory")
+    
+    def choose(self, path, now):
+        # Take a path at time now while playing; returns the new state
+        if self.state != "playing":
+            return self.state
+        
+        self.selected_path = path
+        self.transition_time = now
+        if path == self.correct_path:
+            self.state = "success"
+        elif self.rng.random() < self.trap_chance:
+            self.state = "trap"
+        else:
+            self.state = "dead_end"
+        return self.state
+    
+    def advance(self, now):
+        # Leave the success state once its transition has played out, to the
+        # next fork or to victory. Returns True when the state changed
+        if self.state != "success" or now - self.transition_time <= self.transition_duration:
+            return False
+        
+        self.success_count += 1
+        if self.success_count >= self.win_streak:
+            self.state = "victory"
+        else:
+            self.state = "playing"
+            self.correct_path = self.rng.randrange(self.paths)
+            self.selected_path = 1
+        return True
+    
+    def restart(self):
+        self.state = "playing"
+        self.correct_path = self.rng.randrange(self.paths)
+        self.selected_path = 1
+        self.success_count = 0
+
+# Play one game of rules to its end, taking random paths and skipping the
+# transitions. Returns the final state
+def play_game(rules, rng=random):
+    while not rules.finished():
+        rules.choose(rng.randrange(rules.paths), 0)
+        rules.advance(math.inf)
+    return rules.state
+
+# Game class
+class Game(GameRules):
+    def __init__(self, profiler=None, additive_light=False, seed=SESSION_SEED, clock=None, quality=None,
+                 batch_fills=True, asset_report=None):
+        # Text needs the font module, but no display is required to draw
+        pygame.font.init()
+        
+        # Animations draw their random details from streams derived from this
+        # seed, so the same seed and progress always give the same frame
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        
+        # Source of the current time in seconds: anything with a time() method.
+        # The wall clock by default; main() passes a SimulationClock
+        self.clock = clock if clock is not None else time
+        
+        # Scales effect density to the frame budget; main() feeds it frame times
+        self.quality = quality if quality is not None else QualityGovernor()
+        
+        # Generated images, loaded when first drawn. They are built beforehand
+        # (see build_assets); asset_report is what that build returned
+        self.images = AssetRegistry(report=asset_report)
+        
+        # Game state, moved on by key presses and the clock, with the correct
+        # paths and traps drawn from their own stream of the seed
+        GameRules.__init__(self, random.Random("%d:rules" % self.seed))
         self.message = ""
         
         # For torch animation
@@ -382,35 +1546,67 @@ class Game:
         self.perspective_offset = 0
         self.perspective_target = 0
         
+        # Values before the last update and how far the frame being drawn is
+        # between that and the current update, in ticks (see FixedTimestep)
+        self.previous_flicker = 0
+        self.previous_offset = 0
+        self.alpha = 1.0
+        
         # For transition effects
         self.transition_effect = None
         
         # For animation timing
         self.animation_start_time = 0
         
-        # Load cave textures
-        self.wall_texture = self.create_texture(CAVE_WALL, 100, 100)
-        self.floor_texture = self.create_texture(CAVE_FLOOR, 100, 100)
-    
-    def create_texture(self, base_color, width, height):
-        texture = pygame.Surface((width, height))
-        texture.fill(base_color)
-        
-        # Add some random noise for texture
-        for _ in range(width * height // 10):
-            x = random.randint(0, width - 1)
-            y = random.randint(0, height - 1)
-            brightness = random.randint(-20, 20)
-            color = (
-                max(0, min(255, base_color[0] + brightness)),
-                max(0, min(255, base_color[1] + brightness)),
-                max(0, min(255, base_color[2] + brightness))
-            )
-            pygame.draw.circle(texture, color, (x, y), random.randint(1, 3))
+        # Number of primitive draw calls (fills, blits, shapes, text) issued so far
+        self.draw_calls = 0
+        
+        # Torch and glow light maps, built once
+        self.lighting = LightMaps(additive_light)
         
-        return texture
+        # Fonts and rendered text, with every string the game shows rendered up front
+        self.text = TextCache()
+        self.text.prewarm(self.game_text())
+        
+        # Regions redrawn by the torch light in the last frame (see Presenter)
+        self.frame_rects = []
+        
+        # Per-stage timing (off unless a caller passes an enabled profiler)
+        self.profiler = profiler if profiler is not None else FrameProfiler()
+        self.profiler.counter = self
+        
+        # Baked static cave layers, keyed on the quantized perspective offset
+        self.cave_layers = LayerCache(CAVE_LAYER_CACHE_SIZE)
+        
+        # Trap and falling rocks frames keyed on quantized progress, and rock shapes
+        self.animation_frames = LayerCache(2 * ANIMATION_FRAMES)
+        self.rock_shapes = LayerCache(ROCK_SHAPE_CACHE_SIZE)
+        self.particle_sprites = LayerCache(PARTICLE_SPRITE_CACHE_SIZE)
+        
+        # Fill buffer that fill_block records into while drawing (see
+        # batched_fills). Without batching every block is filled on its own, the
+        # reference output for parity checks (see parity.py)
+        self.batch_fills = batch_fills
+        self.fill_buffer = None
+        
+        # Cave textures, tiled over the whole art area so the cave layer can
+        # copy stretches of them (see blit_span)
+        self.wall_texture = self.create_texture("wall", CAVE_WALL, 3, 15)
+        self.ceiling_texture = self.create_texture("ceiling", CAVE_WALL, 3, 15)
+        self.floor_texture = self.create_texture("floor", CAVE_FLOOR, 4, 20)
+    
+    def create_texture(self, name, base_color, checker, shade):
+        texture = generate_cave_texture(base_color, checker, shade, random.Random("%d:%s" % (self.seed, name)))
+        # One block of the texture covers PIXEL_SIZE x PIXEL_SIZE screen pixels
+        texture = surface_pool.adopt(pygame.transform.scale(texture, (TEXTURE_BLOCKS * PIXEL_SIZE,
+                                                                      TEXTURE_BLOCKS * PIXEL_SIZE)))
+        return tile_texture(texture, (SCREEN_WIDTH, SCREEN_HEIGHT))
     
     def update(self):
+        # One fixed simulation step of TICK_SECONDS
+        self.previous_flicker = self.torch_flicker
+        self.previous_offset = self.perspective_offset
+        
         # Update torch flicker
         self.torch_flicker = (self.torch_flicker + 0.1) % (2 * math.pi)
         
@@ -422,7 +1618,7 @@ class Game:
         
         # Handle transition effects
         if self.transition_effect:
-            current_time = time.time()
+            current_time = self.clock.time()
             progress = (current_time - self.transition_effect["start_time"]) / self.transition_effect["duration"]
             
             if progress >= 1.0:
@@ -434,219 +1630,187 @@ class Game:
                 self.perspective_offset = self.perspective_target * (1 - zoom_factor)
         
         # Handle transitions
-        if self.state == "success":
-            if time.time() - self.transition_time > self.transition_duration:
-                self.success_count += 1
-                if self.success_count >= 5:  # Changed from 2 to 5
-                    self.state = "victory"
-                else:
-                    self.state = "playing"
-                    self.correct_path = random.randint(0, 2)
-                    # Reset perspective to center for next choice
-                    self.perspective_offset = 0
-                    self.perspective_target = 0
-                    self.selected_path = 1  # Reset to middle path
+        if self.advance(self.clock.time()) and self.state == "playing":
+            # Reset perspective to center for next choice
+            self.perspective_offset = 0
+            self.perspective_target = 0
     
     def handle_key(self, key):
+        # Returns True when the key changed the game, False when it was ignored
+        # (e.g. arrows during a transition)
         if self.state == "playing":
             if key == pygame.K_LEFT:
                 self.selected_path = 0
                 self.perspective_target = -0.3  # Move view to left
                 self.check_path()
+                return True
             elif key == pygame.K_UP:
                 self.selected_path = 1
                 self.perspective_target = 0  # Center view
                 self.check_path()
+                return True
             elif key == pygame.K_RIGHT:
                 self.selected_path = 2
                 self.perspective_target = 0.3  # Move view to right
                 self.check_path()
-        elif self.state in ["trap", "dead_end", "victory"]:
+                return True
+        elif self.finished():
             if key == pygame.K_SPACE:  # Changed from R key to Space key
                 self.reset_game()
+                return True
+        return False
     
     def reset_game(self):
         # Reset the game state
-        self.state = "playing"
-        self.correct_path = random.randint(0, 2)
-        self.selected_path = 1  # Default to middle
-        self.success_count = 0
+        self.restart()
         self.perspective_offset = 0
         self.perspective_target = 0
     
     def check_path(self):
-        self.transition_time = time.time()
-        self.animation_start_time = time.time()  # Set animation start time
+        # Animations start at the moment on screen when the key was pressed,
+        # which can be up to a tick before the last update
+        self.animation_start_time = self.render_time()  # Set animation start time
         
-        if self.selected_path == self.correct_path:
-            self.state = "success"
+        if self.choose(self.selected_path, self.render_time()) == "success":
             self.message = "Correct! Moving to the next passage..."
             
             # Create a transition effect to show movement to next passage
             self.transition_effect = {
-                "start_time": time.time(),
+                "start_time": self.render_time(),
                 "duration": 1.0,
                 "type": "forward_movement"
             }
+        elif self.state == "trap":
+            self.message = "It's a trap! Game over."
         else:
-            # Randomly choose between trap and dead end
-            if random.random() < 0.5:
-                self.state = "trap"
-                self.message = "It's a trap! Game over."
-            else:
-                self.state = "dead_end"
-                self.message = "Dead end... Game over."
+            self.message = "Dead end... Game over."
+    
+    def set_interpolation(self, alpha):
+        # Draw the following frames alpha ticks past the previous update
+        self.alpha = alpha
+    
+    def render_time(self):
+        # Clock time of the frame being drawn, between the last two updates
+        return self.clock.time() - (1 - self.alpha) * TICK_SECONDS
+    
+    def render_offset(self):
+        return self.previous_offset + (self.perspective_offset - self.previous_offset) * self.alpha
+    
+    def render_flicker(self):
+        # The flicker phase wraps around, so interpolate the step it took
+        step = (self.torch_flicker - self.previous_flicker) % (2 * math.pi)
+        return self.previous_flicker + step * self.alpha
+    
+    def draw_first_person_cave(self, surface):
+        # Static cave geometry only changes with the perspective, so it is baked
+        # once per quantized offset and blitted each frame
+        offset = round(self.render_offset(), 2)
+        layer = self.cave_layers.get(offset, lambda: self.bake_cave_layer(offset, surface))
+        self.flush_fills()
+        surface.blit(layer, (0, 0))
+        self.draw_calls += 1
+    
+    def draw_path_markers(self, surface):
+        offset = round(self.render_offset(), 2)
+        arrow_images = ['arrow_left', 'arrow_up', 'arrow_right']
+        self.flush_fills()
+        
+        for i, center in enumerate(PATH_CENTERS):
+            # Adjust center based on perspective
+            adjusted_center = center + offset * 0.5
+            
+            # Draw arrow indicators for all three paths (static position, no floating)
+            # Position the arrows above each tunnel, centering the 60px wide arrow
+            arrow_x = SCREEN_WIDTH * adjusted_center - 30
+            arrow_y = SCREEN_HEIGHT * 0.2
+            surface.blit(self.images[arrow_images[i]], (arrow_x, arrow_y))
+            self.draw_calls += 1
+        
+        # Highlight the selected path with a subtle glow
+        adjusted_center = PATH_CENTERS[self.selected_path] + offset * 0.5
+        self.lighting.draw_glow(surface, (int(SCREEN_WIDTH * adjusted_center), int(SCREEN_HEIGHT * 0.2) + 20))
+        self.draw_calls += 1
+    
+    def bake_cave_layer(self, perspective_offset, target):
+        # Render the static cave (floor, walls, ceiling, tunnels and rock
+        # formations) for one perspective offset into its own Surface, in the
+        # target's pixel format so blitting it needs no conversion
+        surface = surface_pool.create((SCREEN_WIDTH, SCREEN_HEIGHT), 0, target)
+        with self.batched_fills(surface):
+            self.paint_cave_layer(surface, perspective_offset)
+        return surface
     
-    def draw_first_person_cave(self):
+    def paint_cave_layer(self, surface, perspective_offset):
         # Fill with dark background
-        screen.fill(CAVE_DARK)
+        surface.fill(CAVE_DARK)
+        self.draw_calls += 1
         
-        # Draw cave in Minecraft-like pixel art style
+        # Draw cave in Minecraft-like pixel art style. Walls, ceiling and floor
+        # are copied from their textures a row of blocks at a time
         # Draw floor in pixel art style
-        for y in range(int(SCREEN_HEIGHT * 0.6), SCREEN_HEIGHT, PIXEL_SIZE):
-            for x in range(0, SCREEN_WIDTH, PIXEL_SIZE):
-                # Create a checkerboard pattern for floor
-                if (x // (PIXEL_SIZE * 4) + y // (PIXEL_SIZE * 4)) % 2 == 0:
-                    pygame.draw.rect(screen, CAVE_FLOOR, (x, y, PIXEL_SIZE, PIXEL_SIZE))
-                else:
-                    pygame.draw.rect(screen, (CAVE_FLOOR[0] - 20, CAVE_FLOOR[1] - 20, CAVE_FLOOR[2] - 20), 
-                                   (x, y, PIXEL_SIZE, PIXEL_SIZE))
+        floor_top = int(SCREEN_HEIGHT * 0.6)
+        self.blit_span(surface, self.floor_texture, 0, floor_top, SCREEN_WIDTH, SCREEN_HEIGHT - floor_top)
         
-        # Draw left wall in pixel art style
+        # Walls and ceiling as polygons, each drawn a row of blocks at a time
+        slant = perspective_offset * SCREEN_WIDTH * 0.5
+        wall_bottom = SCREEN_HEIGHT * 0.6
         left_wall_points = [
             (0, 0),
-            (SCREEN_WIDTH * 0.25 + self.perspective_offset * SCREEN_WIDTH * 0.5, SCREEN_HEIGHT * 0.6),
+            (SCREEN_WIDTH * 0.25 + slant, wall_bottom),
+            (SCREEN_WIDTH * 0.25 + slant, SCREEN_HEIGHT),
             (0, SCREEN_HEIGHT)
         ]
+        for x, y, width in polygon_spans(left_wall_points):
+            self.blit_span(surface, self.wall_texture, x, y, width)
         
-        # Fill the left wall area with pixel blocks
-        min_x = 0
-        max_x = int(SCREEN_WIDTH * 0.25 + self.perspective_offset * SCREEN_WIDTH * 0.5)
-        for y in range(0, SCREEN_HEIGHT, PIXEL_SIZE):
-            # Calculate the right edge of the wall at this y-coordinate
-            if y < SCREEN_HEIGHT * 0.6:
-                # Top part of wall (sloped)
-                right_edge = int(y * max_x / (SCREEN_HEIGHT * 0.6))
-            else:
-                # Bottom part of wall (vertical)
-                right_edge = max_x
-            
-            for x in range(0, right_edge, PIXEL_SIZE):
-                # Create a pattern for wall
-                if ((x // (PIXEL_SIZE * 3) + y // (PIXEL_SIZE * 3)) % 2 == 0):
-                    pygame.draw.rect(screen, CAVE_WALL, (x, y, PIXEL_SIZE, PIXEL_SIZE))
-                else:
-                    pygame.draw.rect(screen, (CAVE_WALL[0] - 15, CAVE_WALL[1] - 15, CAVE_WALL[2] - 15), 
-                                   (x, y, PIXEL_SIZE, PIXEL_SIZE))
-        
-        # Draw right wall in pixel art style
         right_wall_points = [
             (SCREEN_WIDTH, 0),
-            (SCREEN_WIDTH * 0.75 + self.perspective_offset * SCREEN_WIDTH * 0.5, SCREEN_HEIGHT * 0.6),
-            (SCREEN_WIDTH, SCREEN_HEIGHT)
+            (SCREEN_WIDTH, SCREEN_HEIGHT),
+            (SCREEN_WIDTH * 0.75 + slant, SCREEN_HEIGHT),
+            (SCREEN_WIDTH * 0.75 + slant, wall_bottom)
         ]
+        for x, y, width in polygon_spans(right_wall_points):
+            self.blit_span(surface, self.wall_texture, x, y, width)
         
-        # Fill the right wall area with pixel blocks
-        min_x = int(SCREEN_WIDTH * 0.75 + self.perspective_offset * SCREEN_WIDTH * 0.5)
-        max_x = SCREEN_WIDTH
-        for y in range(0, SCREEN_HEIGHT, PIXEL_SIZE):
-            # Calculate the left edge of the wall at this y-coordinate
-            if y < SCREEN_HEIGHT * 0.6:
-                # Top part of wall (sloped)
-                left_edge = int(SCREEN_WIDTH - (y * (SCREEN_WIDTH - min_x) / (SCREEN_HEIGHT * 0.6)))
-            else:
-                # Bottom part of wall (vertical)
-                left_edge = min_x
-            
-            for x in range(left_edge, SCREEN_WIDTH, PIXEL_SIZE):
-                # Create a pattern for wall
-                if ((x // (PIXEL_SIZE * 3) + y // (PIXEL_SIZE * 3)) % 2 == 0):
-                    pygame.draw.rect(screen, CAVE_WALL, (x, y, PIXEL_SIZE, PIXEL_SIZE))
-                else:
-                    pygame.draw.rect(screen, (CAVE_WALL[0] - 15, CAVE_WALL[1] - 15, CAVE_WALL[2] - 15), 
-                                   (x, y, PIXEL_SIZE, PIXEL_SIZE))
-        
-        # Draw ceiling in pixel art style
-        for y in range(0, int(SCREEN_HEIGHT * 0.3), PIXEL_SIZE):
-            for x in range(0, SCREEN_WIDTH, PIXEL_SIZE):
-                # Calculate the edges of the ceiling at this y-coordinate
-                progress = y / (SCREEN_HEIGHT * 0.3)
-                left_edge = int(SCREEN_WIDTH * 0.25 * progress + self.perspective_offset * SCREEN_WIDTH * 0.5 * progress)
-                right_edge = int(SCREEN_WIDTH - SCREEN_WIDTH * 0.25 * progress + self.perspective_offset * SCREEN_WIDTH * 0.5 * progress)
-                
-                if left_edge <= x < right_edge:
-                    # Create a pattern for ceiling
-                    if ((x // (PIXEL_SIZE * 3) + y // (PIXEL_SIZE * 3)) % 2 == 0):
-                        pygame.draw.rect(screen, CAVE_WALL, (x, y, PIXEL_SIZE, PIXEL_SIZE))
-                    else:
-                        pygame.draw.rect(screen, (CAVE_WALL[0] - 15, CAVE_WALL[1] - 15, CAVE_WALL[2] - 15), 
-                                       (x, y, PIXEL_SIZE, PIXEL_SIZE))
+        ceiling_bottom = SCREEN_HEIGHT * 0.3
+        ceiling_points = [
+            (0, 0),
+            (SCREEN_WIDTH, 0),
+            (SCREEN_WIDTH * 0.75 + slant, ceiling_bottom),
+            (SCREEN_WIDTH * 0.25 + slant, ceiling_bottom)
+        ]
+        for x, y, width in polygon_spans(ceiling_points):
+            self.blit_span(surface, self.ceiling_texture, x, y, width)
         
         # Draw the three realistic cave passages - static, no flickering
-        path_centers = [0.25, 0.5, 0.75]  # Left, middle, right positions
-        
-        for i, center in enumerate(path_centers):
+        for center in PATH_CENTERS:
             # Adjust center based on perspective
-            adjusted_center = center + self.perspective_offset * 0.5
+            adjusted_center = center + perspective_offset * 0.5
             
             # Calculate path dimensions
             path_width = 0.15
-            path_height = 0.4
             
-            # Calculate tunnel coordinates
-            tunnel_left = int(SCREEN_WIDTH * (adjusted_center - path_width/2))
-            tunnel_right = int(SCREEN_WIDTH * (adjusted_center + path_width/2))
+            # Tunnel outline, narrower at the bottom
             tunnel_top = int(SCREEN_HEIGHT * 0.3)
             tunnel_bottom = int(SCREEN_HEIGHT * 0.6)
-            
-            # Draw tunnel in pixel art style (black interior)
-            for y in range(tunnel_top, tunnel_bottom, PIXEL_SIZE):
-                # Calculate tunnel width at this y-coordinate (narrower at bottom)
-                progress = (y - tunnel_top) / (tunnel_bottom - tunnel_top)
-                left_edge = int(tunnel_left + (SCREEN_WIDTH * (adjusted_center - path_width/3) - tunnel_left) * progress)
-                right_edge = int(tunnel_right + (SCREEN_WIDTH * (adjusted_center + path_width/3) - tunnel_right) * progress)
-                
-                for x in range(left_edge, right_edge, PIXEL_SIZE):
-                    pygame.draw.rect(screen, BLACK, (x, y, PIXEL_SIZE, PIXEL_SIZE))
-            
-            # Draw tunnel outline in pixel art style
-            for y in range(tunnel_top, tunnel_bottom, PIXEL_SIZE):
-                # Calculate tunnel width at this y-coordinate
-                progress = (y - tunnel_top) / (tunnel_bottom - tunnel_top)
-                left_edge = int(tunnel_left + (SCREEN_WIDTH * (adjusted_center - path_width/3) - tunnel_left) * progress)
-                right_edge = int(tunnel_right + (SCREEN_WIDTH * (adjusted_center + path_width/3) - tunnel_right) * progress)
-                
-                # Draw left and right edges
-                pygame.draw.rect(screen, CAVE_HIGHLIGHT, (left_edge - PIXEL_SIZE, y, PIXEL_SIZE, PIXEL_SIZE))
-                pygame.draw.rect(screen, CAVE_HIGHLIGHT, (right_edge, y, PIXEL_SIZE, PIXEL_SIZE))
-            
-            # Draw top edge
-            for x in range(tunnel_left, tunnel_right, PIXEL_SIZE):
-                pygame.draw.rect(screen, CAVE_HIGHLIGHT, (x, tunnel_top - PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE))
-            
-            # Draw arrow indicators for all three paths (static position, no floating)
-            # Position the arrows above each tunnel
-            arrow_x = SCREEN_WIDTH * adjusted_center - 30  # Center the 60px wide arrow
-            arrow_y = SCREEN_HEIGHT * 0.2
-            
-            # Draw the appropriate arrow - all with the same color (no dimming for unselected)
-            if i == 0:  # Left path
-                screen.blit(self.images['arrow_left'], (arrow_x, arrow_y))
-            elif i == 1:  # Middle path
-                screen.blit(self.images['arrow_up'], (arrow_x, arrow_y))
-            elif i == 2:  # Right path
-                screen.blit(self.images['arrow_right'], (arrow_x, arrow_y))
-            
-            # Highlight the selected path with a subtle glow
-            if i == self.selected_path:
-                glow_surf = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-                glow_radius = 50
-                for radius in range(glow_radius, 0, -5):
-                    alpha = max(0, 50 - radius)
-                    pygame.draw.circle(glow_surf, (255, 255, 100, alpha),
-                                     (int(SCREEN_WIDTH * adjusted_center), int(SCREEN_HEIGHT * 0.2) + 20),
-                                     radius)
-                screen.blit(glow_surf, (0, 0))
+            tunnel_points = [
+                (int(SCREEN_WIDTH * (adjusted_center - path_width/2)), tunnel_top),
+                (int(SCREEN_WIDTH * (adjusted_center + path_width/2)), tunnel_top),
+                (SCREEN_WIDTH * (adjusted_center + path_width/3), tunnel_bottom),
+                (SCREEN_WIDTH * (adjusted_center - path_width/3), tunnel_bottom)
+            ]
+            spans = list(polygon_spans(tunnel_points))
+            
+            # Draw tunnel in pixel art style (black interior) with its left,
+            # right and top edges highlighted
+            for x, y, width in spans:
+                self.fill_block(surface, BLACK, x, y, width)
+            for x, y, width in spans:
+                self.fill_block(surface, CAVE_HIGHLIGHT, x - PIXEL_SIZE, y)
+                self.fill_block(surface, CAVE_HIGHLIGHT, x + width, y)
+            if spans:
+                x, y, width = spans[0]
+                self.fill_block(surface, CAVE_HIGHLIGHT, x, y - PIXEL_SIZE, width)
         
         # Add some static stalactites (no movement) in pixel art style
         for i in range(5):
@@ -654,12 +1818,8 @@ class Game:
             height = 30 + i % 3 * 10  # Varied but not random heights
             width = 10 + i % 2 * 5    # Varied but not random widths
             
-            # Draw stalactite in pixel art style
-            for py in range(0, height, PIXEL_SIZE):
-                # Calculate width at this height
-                w = int(width * py / height)
-                for px in range(x - w, x + w, PIXEL_SIZE):
-                    pygame.draw.rect(screen, CAVE_WALL, (px, py, PIXEL_SIZE, PIXEL_SIZE))
+            for span in polygon_spans([(x, 0), (x + width, height), (x - width, height)]):
+                self.fill_block(surface, CAVE_WALL, *span)
         
         # Add some static stalagmites (no movement) in pixel art style
         for i in range(3):
@@ -668,97 +1828,193 @@ class Game:
             height = 25 + i * 5  # Varied but not random heights
             width = 10 + i * 3   # Varied but not random widths
             
-            # Draw stalagmite in pixel art style
-            for py in range(base_y - height, base_y, PIXEL_SIZE):
-                # Calculate width at this height
-                w = int(width * (base_y - py) / height)
-                for px in range(x - w, x + w, PIXEL_SIZE):
-                    pygame.draw.rect(screen, CAVE_WALL, (px, py, PIXEL_SIZE, PIXEL_SIZE))
-    
-    def draw(self, screen):
-        # Draw first-person cave view
-        self.draw_first_person_cave()
-        
-        # Draw torches
-        torch_positions = [(100, 150), (SCREEN_WIDTH - 100, 150)]
-        
-        for pos in torch_positions:
-            screen.blit(self.images['torch'], pos)
-            # Add flickering light effect
-            flicker_size = 50 + int(10 * abs(math.sin(self.torch_flicker)))
-            light_surf = pygame.Surface((flicker_size*2, flicker_size*2), pygame.SRCALPHA)
-            for radius in range(flicker_size, 0, -10):
-                alpha = max(0, 100 - radius)
-                pygame.draw.circle(light_surf, (255, 200, 100, alpha), 
-                                 (flicker_size, flicker_size), radius)
-            screen.blit(light_surf, (pos[0] - flicker_size + 15, pos[1] - flicker_size + 15))
+            for span in polygon_spans([(x - width, base_y - height), (x + width, base_y - height), (x, base_y)]):
+                self.fill_block(surface, CAVE_WALL, *span)
+    
+    def draw(self, surface):
+        profiler = self.profiler
+        
+        # Regions that change from frame to frame without the scene key changing
+        # (the flickering torch light), for dirty-rect presentation
+        self.frame_rects = []
+        
+        self.draw_scene(surface)
         
+        if self.state == "playing":
+            # Draw arrows and the glow under the selected path
+            with profiler.stage("draw_path_markers"):
+                self.draw_path_markers(surface)
+            
+            # Draw torches
+            with profiler.stage("torch_light"):
+                torch_positions = [(100, 150), (SCREEN_WIDTH - 100, 150)]
+                
+                self.flush_fills()
+                for pos in torch_positions:
+                    surface.blit(self.images['torch'], pos)
+                    # Add flickering light effect
+                    self.frame_rects.append(self.lighting.draw_torch_light(surface, pos, self.render_flicker()))
+                    self.draw_calls += 2
+        
+        with profiler.stage("draw_text"):
+            self.draw_text(surface)
+    
+    def draw_text(self, surface):
         if self.state == "playing":
             # Draw progress
-            font = pygame.font.SysFont(None, 36)
-            progress_text = font.render(f"Progress: {self.success_count}/5", True, WHITE)
-            screen.blit(progress_text, (SCREEN_WIDTH//2 - progress_text.get_width()//2, 50))
+            self.draw_centered_text(surface, f"Progress: {self.success_count}/{self.win_streak}", 36, WHITE, 50)
             
             # Draw instruction
-            instruction_font = pygame.font.SysFont(None, 24)
-            instruction_text = instruction_font.render("Use arrow keys to choose a path", True, WHITE)
-            screen.blit(instruction_text, (SCREEN_WIDTH//2 - instruction_text.get_width()//2, 90))
+            self.draw_centered_text(surface, "Use arrow keys to choose a path", 24, WHITE, 90)
         
         elif self.state == "success":
-            # Draw tunnel movement animation
-            self.draw_tunnel_movement()
-            
             # Draw success message
-            self.draw_message("Correct! Moving to the next passage...", GREEN)
+            self.draw_message(surface, "Correct! Moving to the next passage...", GREEN)
         
         elif self.state == "trap":
-            # Draw animated trap (spikes moving inward)
-            self.draw_animated_trap()
-            
             # Draw message
-            self.draw_message("It's a trap! Game over.", RED)
+            self.draw_message(surface, "It's a trap! Game over.", RED)
             
             # Draw restart instruction as text (positioned to avoid overlap)
-            self.draw_restart_message()
+            self.draw_restart_message(surface)
         
         elif self.state == "dead_end":
-            # Draw animated falling rocks
-            self.draw_animated_falling_rocks()
-            
             # Draw message
-            self.draw_message("Dead end... Game over.", RED)
+            self.draw_message(surface, "Dead end... Game over.", RED)
             
             # Draw restart instruction as text (positioned to avoid overlap)
-            self.draw_restart_message()
+            self.draw_restart_message(surface)
         
         elif self.state == "victory":
-            # Draw treasure with pixel art sparkle animation
-            self.draw_pixel_art_treasure()
-            
             # Draw victory message
-            font = pygame.font.SysFont(None, 48)
-            victory_text = font.render("You found the treasure!", True, GOLD)
-            screen.blit(victory_text, (SCREEN_WIDTH//2 - victory_text.get_width()//2, 150))
+            self.draw_centered_text(surface, "You found the treasure!", 48, GOLD, 150)
             
             # Draw restart instruction as text (positioned to avoid overlap)
-            self.draw_restart_message()
+            self.draw_restart_message(surface)
+    
+    def game_text(self):
+        # Every (text, size, color) drawn by draw_text, for pre-warming the cache
+        entries = [(f"Progress: {count}/{self.win_streak}", 36, WHITE) for count in range(self.win_streak)]
+        entries += [
+            ("Use arrow keys to choose a path", 24, WHITE),
+            ("Correct! Moving to the next passage...", 36, GREEN),
+            ("It's a trap! Game over.", 36, RED),
+            ("Dead end... Game over.", 36, RED),
+            ("You found the treasure!", 48, GOLD),
+            ("Press SPACE to Restart", 30, WHITE),
+        ]
+        return entries
     
-    def draw_pixel_art_treasure(self):
+    def scene_key(self):
+        # Identifies everything on screen except the torch light: the baked cave,
+        # the glow under the selected path and the text. None means the scene
+        # itself is animated and any pixel may change
+        if self.state == "playing":
+            return (self.state, round(self.render_offset(), 2), self.selected_path, self.success_count)
+        return None
+    
+    def counters(self):
+        # Running totals of the Surface pool, the layer caches and quality
+        # level changes, for the profiler log and overlay
+        caches = {
+            "cave_layers": self.cave_layers,
+            "animation_frames": self.animation_frames,
+            "rock_shapes": self.rock_shapes,
+            "particle_sprites": self.particle_sprites,
+            "text": self.text.rendered,
+        }
+        return {
+            "quality_changes": self.quality.changes,
+            "surfaces": {"created": surface_pool.created, "reused": surface_pool.reused},
+            "caches": {name: {"hits": cache.hits, "misses": cache.misses} for name, cache in caches.items()},
+        }
+    
+    def render_frame(self, surface=None):
+        # Draw the current frame into an off-screen Surface and return it. No
+        # display is needed, so this also works headless and in worker processes
+        if surface is None:
+            surface = surface_pool.create((SCREEN_WIDTH, SCREEN_HEIGHT))
+        self.draw(surface)
+        return surface
+    
+    def draw_scene(self, surface):
+        # Draw the pixel art for the current state. The other states repaint the
+        # whole surface, so the cave is only drawn while choosing a path. The
+        # stage is opened outside the fill buffer so its final flush is
+        # counted in the state's time and draw calls
+        draw = self.state_drawer()
+        with self.profiler.stage(draw.__name__):
+            with self.batched_fills(surface):
+                draw(surface)
+    
+    def state_drawer(self):
+        if self.state == "playing":
+            # Draw first-person cave view
+            return self.draw_first_person_cave
+        elif self.state == "success":
+            # Draw tunnel movement animation
+            return self.draw_tunnel_movement
+        elif self.state == "trap":
+            # Draw animated trap (spikes moving inward)
+            return self.draw_animated_trap
+        elif self.state == "dead_end":
+            # Draw animated falling rocks
+            return self.draw_animated_falling_rocks
+        else:
+            # Draw treasure with pixel art sparkle animation
+            return self.draw_pixel_art_treasure
+    
+    def fill_block(self, surface, color, x, y, width=PIXEL_SIZE, height=PIXEL_SIZE):
+        # Fill one block of pixel art (sizes are multiples of PIXEL_SIZE)
+        buffer = self.fill_buffer
+        if buffer is not None and buffer.surface is surface:
+            buffer.fill(color, x, y, width, height)
+        else:
+            surface.fill(color, (x, y, width, height))
+            self.draw_calls += 1
+    
+    @contextmanager
+    def batched_fills(self, surface):
+        # Record fill_block calls on surface in a FillBuffer, submitted when
+        # the block ends or when something else is drawn over them
+        if not self.batch_fills:
+            yield None
+            return
+        
+        previous = self.fill_buffer
+        self.fill_buffer = FillBuffer(surface)
+        try:
+            yield self.fill_buffer
+        finally:
+            self.flush_fills()
+            self.fill_buffer = previous
+    
+    def flush_fills(self):
+        # Call before blitting onto a surface that may have buffered fills
+        if self.fill_buffer is not None:
+            self.draw_calls += self.fill_buffer.flush()
+    
+    def effect_count(self, count):
+        # How many of count particles, rays or segments the quality level allows
+        return max(1, int(count * self.quality.density()))
+    
+    def blit_span(self, surface, texture, x, y, width, height=PIXEL_SIZE):
+        # Copy the blocks of a tiled texture covering the given area; one blit
+        # instead of a fill per block
+        self.draw_calls += 1
+        self.flush_fills()
+        surface.blit(texture, (x, y), (x, y, width, height))
+    
+    def draw_pixel_art_treasure(self, surface):
         # Fill background with dark cave color
-        screen.fill(CAVE_DARK)
+        surface.fill(CAVE_DARK)
+        self.draw_calls += 1
         
         # Draw cave floor in pixel art style
-        for y in range(SCREEN_HEIGHT//2, SCREEN_HEIGHT, PIXEL_SIZE):
-            for x in range(0, SCREEN_WIDTH, PIXEL_SIZE):
-                # Create a checkerboard pattern for floor
-                if (x // (PIXEL_SIZE * 4) + y // (PIXEL_SIZE * 4)) % 2 == 0:
-                    pygame.draw.rect(screen, CAVE_FLOOR, (x, y, PIXEL_SIZE, PIXEL_SIZE))
-                else:
-                    pygame.draw.rect(screen, (CAVE_FLOOR[0] - 20, CAVE_FLOOR[1] - 20, CAVE_FLOOR[2] - 20), 
-                                   (x, y, PIXEL_SIZE, PIXEL_SIZE))
+        self.paint_floor(surface, SCREEN_HEIGHT//2)
         
         # Calculate animation time
-        animation_time = time.time() - self.animation_start_time
+        animation_time = self.render_time() - self.animation_start_time
         
         # Draw treasure chest (pixel art style)
         chest_width = 200
@@ -772,10 +2028,10 @@ class Game:
                 if (x == chest_x or x >= chest_x + chest_width - PIXEL_SIZE or 
                     y >= chest_y + chest_height - PIXEL_SIZE):
                     # Draw border pixels darker
-                    pygame.draw.rect(screen, DARK_BROWN, (x, y, PIXEL_SIZE, PIXEL_SIZE))
+                    self.fill_block(surface, DARK_BROWN, x, y)
                 else:
                     # Draw inner pixels
-                    pygame.draw.rect(screen, BROWN, (x, y, PIXEL_SIZE, PIXEL_SIZE))
+                    self.fill_block(surface, BROWN, x, y)
         
         # Draw chest top (pixel by pixel) - fully open position
         lid_angle = -60  # Degrees (negative means open upward)
@@ -796,259 +2052,286 @@ class Game:
                 if (x == chest_x + x_offset or x >= chest_x + chest_width + x_offset - PIXEL_SIZE or 
                     y <= chest_y + lid_offset_y - lid_height + PIXEL_SIZE):
                     # Draw border pixels darker
-                    pygame.draw.rect(screen, DARK_BROWN, (x, y, PIXEL_SIZE, PIXEL_SIZE))
+                    self.fill_block(surface, DARK_BROWN, x, y)
                 else:
                     # Draw inner pixels
-                    pygame.draw.rect(screen, BROWN, (x, y, PIXEL_SIZE, PIXEL_SIZE))
+                    self.fill_block(surface, BROWN, x, y)
         
         # Draw chest hinge (pixel by pixel)
         for y in range(chest_y, chest_y + 10, PIXEL_SIZE):
             for x in range(chest_x, chest_x + chest_width, PIXEL_SIZE):
-                pygame.draw.rect(screen, DARK_BROWN, (x, y, PIXEL_SIZE, PIXEL_SIZE))
-        
-        # Draw treasure inside chest (pixel art style)
-        treasure_colors = [
-            GOLD,                  # Gold
-            (192, 192, 192),       # Silver
-            (255, 0, 0),           # Ruby
-            (0, 0, 255),           # Sapphire
-            (0, 255, 0),           # Emerald
-            (255, 0, 255),         # Amethyst
-            (0, 255, 255)          # Diamond
-        ]
+                self.fill_block(surface, DARK_BROWN, x, y)
         
-        # Draw piles of treasure (pixel by pixel) - more visible now that chest is fully open
-        for i in range(80):  # Increased number of treasure items
-            # Calculate position with slight animation
-            offset_x = math.sin(animation_time * 2 + i) * 3
-            offset_y = math.cos(animation_time * 3 + i) * 2
-            
-            # Spread treasure more widely around the open chest
-            spread_factor = 1.5
-            x = chest_x + 20 + (i * 3) % (chest_width - 40) + int(offset_x)
-            y = chest_y + chest_height//3 + (i * 5) % (chest_height - chest_height//3 - 20) + int(offset_y)
-            
-            # Some treasure spilling out
-            if i % 5 == 0:
-                x += random.randint(-30, 30)
-                y += random.randint(-10, 20)
-            
-            # Randomize size and color for variety
-            size = (i % 3 + 1) * PIXEL_SIZE
-            color = treasure_colors[i % len(treasure_colors)]
-            
-            # Draw treasure item (pixel by pixel)
-            for px in range(x, x + size, PIXEL_SIZE):
-                for py in range(y, y + size, PIXEL_SIZE):
-                    if 0 <= px < SCREEN_WIDTH and 0 <= py < SCREEN_HEIGHT:
-                        pygame.draw.rect(screen, color, (px, py, PIXEL_SIZE, PIXEL_SIZE))
-        
-        # Draw sparkles all over the screen (pixel art style)
-        for i in range(100):
-            # Calculate sparkle position and timing
-            sparkle_x = (i * 37 + int(animation_time * 50)) % SCREEN_WIDTH
-            sparkle_y = (i * 23 + int(animation_time * 30)) % SCREEN_HEIGHT
-            
-            # Make sparkles appear and disappear
-            sparkle_time = (animation_time + i * 0.1) % 2
-            if sparkle_time < 1.0:  # Only show some sparkles at a time
-                # Determine sparkle size based on its life cycle
-                if sparkle_time < 0.3:
-                    size = PIXEL_SIZE
-                elif sparkle_time < 0.6:
-                    size = PIXEL_SIZE * 2
-                elif sparkle_time < 0.8:
-                    size = PIXEL_SIZE * 3
-                else:
-                    size = PIXEL_SIZE
-                
-                # Draw sparkle (pixel art style)
-                # Center pixel
-                pygame.draw.rect(screen, WHITE, 
-                               (sparkle_x, sparkle_y, PIXEL_SIZE, PIXEL_SIZE))
-                
-                # Cross pattern for larger sparkles
-                if size >= PIXEL_SIZE * 2:
-                    pygame.draw.rect(screen, WHITE, 
-                                   (sparkle_x + PIXEL_SIZE, sparkle_y, PIXEL_SIZE, PIXEL_SIZE))
-                    pygame.draw.rect(screen, WHITE, 
-                                   (sparkle_x - PIXEL_SIZE, sparkle_y, PIXEL_SIZE, PIXEL_SIZE))
-                    pygame.draw.rect(screen, WHITE, 
-                                   (sparkle_x, sparkle_y + PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE))
-                    pygame.draw.rect(screen, WHITE, 
-                                   (sparkle_x, sparkle_y - PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE))
-                
-                # Diagonal pixels for the largest sparkles
-                if size >= PIXEL_SIZE * 3:
-                    pygame.draw.rect(screen, WHITE, 
-                                   (sparkle_x + PIXEL_SIZE, sparkle_y + PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE))
-                    pygame.draw.rect(screen, WHITE, 
-                                   (sparkle_x - PIXEL_SIZE, sparkle_y - PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE))
-                    pygame.draw.rect(screen, WHITE, 
-                                   (sparkle_x + PIXEL_SIZE, sparkle_y - PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE))
-                    pygame.draw.rect(screen, WHITE, 
-                                   (sparkle_x - PIXEL_SIZE, sparkle_y + PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE))
-    
-    def draw_animated_trap(self):
-        # Fill background
-        screen.fill(CAVE_DARK)
+        # Draw piles of treasure and the sparkles all over the screen, one
+        # batch of particles each
+        self.draw_particles(surface, self.treasure_particles(animation_time))
+        self.draw_particles(surface, self.sparkle_particles(animation_time))
+    
+    def treasure_particles(self, animation_time):
+        # Treasure items in the open chest, bobbing slightly, sized and
+        # colored for variety, with every fifth one spilled out of the pile
+        chest_width = 200
+        chest_height = 120
+        chest_x = (SCREEN_WIDTH - chest_width) // 2
+        chest_y = (SCREEN_HEIGHT - chest_height) // 2
         
-        # Draw cave floor in pixel art style
-        for y in range(SCREEN_HEIGHT//2, SCREEN_HEIGHT, PIXEL_SIZE):
-            for x in range(0, SCREEN_WIDTH, PIXEL_SIZE):
-                # Create a checkerboard pattern for floor
-                if (x // (PIXEL_SIZE * 4) + y // (PIXEL_SIZE * 4)) % 2 == 0:
-                    pygame.draw.rect(screen, CAVE_FLOOR, (x, y, PIXEL_SIZE, PIXEL_SIZE))
-                else:
-                    pygame.draw.rect(screen, (CAVE_FLOOR[0] - 20, CAVE_FLOOR[1] - 20, CAVE_FLOOR[2] - 20), 
-                                   (x, y, PIXEL_SIZE, PIXEL_SIZE))
+        i = numpy.arange(80)
+        offset_x = (numpy.sin(animation_time * 2 + i) * 3).astype(int)
+        offset_y = (numpy.cos(animation_time * 3 + i) * 2).astype(int)
+        x = chest_x + 20 + (i * 3) % (chest_width - 40) + offset_x
+        y = chest_y + chest_height//3 + (i * 5) % (chest_height - chest_height//3 - 20) + offset_y
+        
+        # Spilled treasure jitters with this frame's own random stream
+        spilled = i % 5 == 0
+        rng = self.particle_rng("treasure", animation_time / (self.transition_duration * 0.8))
+        x[spilled] += rng.integers(-30, 30, spilled.sum(), endpoint=True)
+        y[spilled] += rng.integers(-10, 20, spilled.sum(), endpoint=True)
         
+        return Particles(x, y, i % 3 + 1, numpy.array(TREASURE_COLORS)[i % len(TREASURE_COLORS)])
+    
+    def sparkle_particles(self, animation_time):
+        # Sparkles drifting over the screen, each shown for one second out of
+        # two and growing from a dot to a cross to a star over that second
+        i = numpy.arange(self.effect_count(100))
+        x = (i * 37 + int(animation_time * 50)) % SCREEN_WIDTH
+        y = (i * 23 + int(animation_time * 30)) % SCREEN_HEIGHT
+        
+        life = (animation_time + i * 0.1) % 2
+        alive = life < 1.0
+        size = numpy.select([life < 0.3, life < 0.6, life < 0.8], [1, 2, 3], 1)
+        return Particles(x[alive], y[alive], size[alive], WHITE, "sparkle", life[alive])
+    
+    def particle_rng(self, name, progress):
+        # NumPy generator for vectorized draws, seeded like animation_rng
+        return numpy.random.default_rng(self.animation_rng(name, progress).getrandbits(64))
+    
+    def draw_particles(self, surface, particles):
+        # Blit every particle of the set at once. Sprites are cached per
+        # shape, size and color and looked up once per (size, color) group;
+        # the batch keeps the particles' order, so overlaps draw as before
+        if not len(particles):
+            return
+        
+        # Size and color packed into one integer per particle, size above the
+        # 24 bits of color
+        color = particles.color
+        packed = particles.size << 24 | color[:, 0] << 16 | color[:, 1] << 8 | color[:, 2]
+        groups, group_of = numpy.unique(packed, return_inverse=True)
+        
+        images = []
+        anchors = []
+        for group in groups.tolist():
+            key = (particles.shape, group >> 24, (group >> 16 & 255, group >> 8 & 255, group & 255))
+            image, anchor = self.particle_sprites.get(key, lambda: self.build_particle_sprite(*key))
+            images.append(image)
+            anchors.append(anchor)
+        
+        offset = numpy.array(anchors)[group_of] * PIXEL_SIZE
+        positions = zip((particles.x + offset).tolist(), (particles.y + offset).tolist())
+        batch = list(zip([images[group] for group in group_of.tolist()], positions))
+        self.flush_fills()
+        surface.blits(batch, False)
+        self.draw_calls += 1
+    
+    def build_particle_sprite(self, shape, size, color):
+        # Returns the sprite and its offset from the particle position in blocks
+        if shape == "square":
+            image = surface_pool.create((size * PIXEL_SIZE, size * PIXEL_SIZE))
+            image.fill(color)
+            return image, 0
+        
+        # Sparkle: a center PIXEL_SIZE, a cross for size 2 and diagonals for size 3
+        image = surface_pool.create((3 * PIXEL_SIZE, 3 * PIXEL_SIZE))
+        image.fill(SPRITE_COLORKEY)
+        image.set_colorkey(SPRITE_COLORKEY)
+        cells = [(1, 1)]
+        if size >= 2:
+            cells += [(2, 1), (0, 1), (1, 2), (1, 0)]
+        if size >= 3:
+            cells += [(2, 2), (0, 0), (2, 0), (0, 2)]
+        for cx, cy in cells:
+            image.fill(color, (cx * PIXEL_SIZE, cy * PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE))
+        return image, -1
+    
+    def draw_animated_trap(self, surface):
         # Calculate animation progress (0.0 to 1.0)
-        progress = min(1.0, (time.time() - self.animation_start_time) / (self.transition_duration * 0.8))
+        progress = min(1.0, (self.render_time() - self.animation_start_time) / (self.transition_duration * 0.8))
+        
+        # The floor and spikes depend only on progress, so a cached frame is replayed
+        frame = self.animation_frame("trap", progress, self.paint_trap)
+        self.flush_fills()
+        surface.blit(frame, (0, 0))
+        self.draw_calls += 1
+    
+    def paint_trap(self, surface, progress):
+        # Fill background
+        surface.fill(CAVE_DARK)
+        
+        # Draw cave floor in pixel art style
+        self.paint_floor(surface, SCREEN_HEIGHT//2)
         
         # Draw spikes coming from all directions in pixel art style
-        # The spikes move inward as progress increases
+        # The spikes move inward as progress increases (all spikes of one
+        # direction are the same shape, so each shape is built once per frame)
+        length = int(150 * progress)
         
         # Spikes from floor
+        floor_spike = self.spike_shape("floor", length)
         for x in range(0, SCREEN_WIDTH, PIXEL_SIZE * 8):
-            height = int(150 * progress)  # Height increases with progress
-            
-            # Draw spike in pixel art style
-            for y in range(SCREEN_HEIGHT // 2, SCREEN_HEIGHT // 2 - height, -PIXEL_SIZE):
-                # Calculate width at this height
-                width = int(PIXEL_SIZE * 4 * (SCREEN_HEIGHT // 2 - y) / height)
-                for px in range(x - width, x + width, PIXEL_SIZE):
-                    if 0 <= px < SCREEN_WIDTH:
-                        pygame.draw.rect(screen, GRAY, (px, y, PIXEL_SIZE, PIXEL_SIZE))
-            
-            # Add metallic highlights
-            highlight_x = x + PIXEL_SIZE
-            for y in range(SCREEN_HEIGHT // 2, SCREEN_HEIGHT // 2 - height * 4 // 5, -PIXEL_SIZE * 2):
-                pygame.draw.rect(screen, WHITE, (highlight_x, y, PIXEL_SIZE, PIXEL_SIZE))
+            self.draw_shape(surface, floor_spike, x, SCREEN_HEIGHT // 2)
         
         # Spikes from ceiling
+        ceiling_spike = self.spike_shape("ceiling", length)
         for x in range(PIXEL_SIZE * 4, SCREEN_WIDTH, PIXEL_SIZE * 8):
-            height = int(150 * progress)  # Height increases with progress
-            
-            # Draw spike in pixel art style
-            for y in range(0, height, PIXEL_SIZE):
-                # Calculate width at this height
-                width = int(PIXEL_SIZE * 4 * y / height)
-                for px in range(x - width, x + width, PIXEL_SIZE):
-                    if 0 <= px < SCREEN_WIDTH:
-                        pygame.draw.rect(screen, GRAY, (px, y, PIXEL_SIZE, PIXEL_SIZE))
-            
-            # Add metallic highlights
-            highlight_x = x - PIXEL_SIZE
-            for y in range(0, height * 4 // 5, PIXEL_SIZE * 2):
-                pygame.draw.rect(screen, WHITE, (highlight_x, y, PIXEL_SIZE, PIXEL_SIZE))
+            self.draw_shape(surface, ceiling_spike, x, 0)
         
-        # Spikes from left wall
+        # Spikes from left and right walls
+        left_spike = self.spike_shape("left", length)
+        right_spike = self.spike_shape("right", length)
         for y in range(SCREEN_HEIGHT // 4, SCREEN_HEIGHT * 3 // 4, PIXEL_SIZE * 8):
-            length = int(150 * progress)  # Length increases with progress
-            
-            # Draw spike in pixel art style
-            for x in range(0, length, PIXEL_SIZE):
-                # Calculate height at this position
-                height = int(PIXEL_SIZE * 4 * x / length)
-                for py in range(y - height, y + height, PIXEL_SIZE):
-                    if 0 <= py < SCREEN_HEIGHT:
-                        pygame.draw.rect(screen, GRAY, (x, py, PIXEL_SIZE, PIXEL_SIZE))
-            
-            # Add metallic highlights
-            highlight_y = y + PIXEL_SIZE
-            for x in range(0, length * 4 // 5, PIXEL_SIZE * 2):
-                pygame.draw.rect(screen, WHITE, (x, highlight_y, PIXEL_SIZE, PIXEL_SIZE))
-        
-        # Spikes from right wall
+            self.draw_shape(surface, left_spike, 0, y)
         for y in range(SCREEN_HEIGHT // 4, SCREEN_HEIGHT * 3 // 4, PIXEL_SIZE * 8):
-            length = int(150 * progress)  # Length increases with progress
-            
-            # Draw spike in pixel art style
-            for x in range(SCREEN_WIDTH, SCREEN_WIDTH - length, -PIXEL_SIZE):
-                # Calculate height at this position
-                height = int(PIXEL_SIZE * 4 * (SCREEN_WIDTH - x) / length)
-                for py in range(y - height, y + height, PIXEL_SIZE):
-                    if 0 <= py < SCREEN_HEIGHT:
-                        pygame.draw.rect(screen, GRAY, (x, py, PIXEL_SIZE, PIXEL_SIZE))
-            
-            # Add metallic highlights
-            highlight_y = y - PIXEL_SIZE
-            for x in range(SCREEN_WIDTH, SCREEN_WIDTH - length * 4 // 5, -PIXEL_SIZE * 2):
-                pygame.draw.rect(screen, WHITE, (x, highlight_y, PIXEL_SIZE, PIXEL_SIZE))
+            self.draw_shape(surface, right_spike, SCREEN_WIDTH, y)
     
-    def draw_animated_falling_rocks(self):
-        # Fill background
-        screen.fill(CAVE_DARK)
+    def spike_shape(self, direction, length):
+        # One spike of the given length as blocks relative to its base point,
+        # with a line of metallic highlights along it
+        reach = PIXEL_SIZE * 4
+        if direction == "floor":
+            points = [(0, 0), (reach, -length), (-reach, -length)]
+            highlights = [(PIXEL_SIZE, dy) for dy in range(0, -(length * 4 // 5), -PIXEL_SIZE * 2)]
+        elif direction == "ceiling":
+            points = [(0, 0), (reach, length), (-reach, length)]
+            highlights = [(-PIXEL_SIZE, dy) for dy in range(0, length * 4 // 5, PIXEL_SIZE * 2)]
+        elif direction == "left":
+            points = [(0, 0), (length, -reach), (length, reach)]
+            highlights = [(dx, PIXEL_SIZE) for dx in range(0, length * 4 // 5, PIXEL_SIZE * 2)]
+        else:
+            # Right wall
+            points = [(0, 0), (-length, -reach), (-length, reach)]
+            highlights = [(dx, -PIXEL_SIZE) for dx in range(0, -(length * 4 // 5), -PIXEL_SIZE * 2)]
+        
+        # The shape keeps single blocks so off-screen ones can still be clipped
+        cells = [(dx, y, GRAY, True)
+                 for x, y, width in polygon_spans(points)
+                 for dx in range(x, x + width, PIXEL_SIZE)]
+        cells += [(dx, dy, WHITE, False) for dx, dy in highlights]
+        vertical = direction in ("floor", "ceiling")
+        return CellShape(cells, clip_x=vertical, clip_y=not vertical)
+    
+    def rock_shape(self, size, x, y):
+        # A falling rock with its motion blur trail, centered on (x, y). The
+        # checkered pattern is fixed to the screen, so a shape only fits rocks
+        # at the same position modulo the pattern period
+        period = PIXEL_SIZE * 4
+        key = (size, x % period, y % period)
+        return self.rock_shapes.get(key, lambda: self.build_rock_shape(*key))
+    
+    def build_rock_shape(self, size, phase_x, phase_y):
+        cells = []
+        
+        # Draw rock as a collection of pixels within its circular boundary
+        for dy in range(-size, size, PIXEL_SIZE):
+            for dx in range(-size, size, PIXEL_SIZE):
+                if dx**2 + dy**2 < size**2:
+                    # Create a pattern for the rock
+                    if (((phase_x + dx) // (PIXEL_SIZE * 2) + (phase_y + dy) // (PIXEL_SIZE * 2)) % 2 == 0):
+                        cells.append((dx, dy, GRAY, True))
+                    else:
+                        cells.append((dx, dy, (GRAY[0] - 30, GRAY[1] - 30, GRAY[2] - 30), True))
         
-        # Draw cave floor in pixel art style
-        for y in range(SCREEN_HEIGHT//2, SCREEN_HEIGHT, PIXEL_SIZE):
+        # Add motion blur effect (lines trailing behind rocks) in pixel art style
+        blur_length = 30
+        for dy in range(-blur_length, 0, PIXEL_SIZE * 2):
+            # Calculate x position along the blur line
+            x_offset = int(-dy * size / blur_length / 2)
+            
+            # Draw a few pixels for the blur
+            for dx in range(-x_offset, x_offset, PIXEL_SIZE * 2):
+                cells.append((dx, dy, (GRAY[0] - 20, GRAY[1] - 20, GRAY[2] - 20), True))
+        
+        return CellShape(cells, clip_x=True, clip_y=True)
+    
+    def draw_shape(self, surface, shape, x, y):
+        # Draw a CellShape anchored at (x, y): as a single sprite blit when none
+        # of its clipped blocks would start off-screen, otherwise block by block
+        # with the same clipping the per-block loops always had
+        if shape.fits(x, y):
+            self.flush_fills()
+            surface.blit(self.shape_sprite(shape), (x + shape.left, y + shape.top))
+            self.draw_calls += 1
+            return
+        
+        for dx, dy, color, clipped in shape.cells:
+            if clipped and ((shape.clip_x and not 0 <= x + dx < SCREEN_WIDTH) or
+                            (shape.clip_y and not 0 <= y + dy < SCREEN_HEIGHT)):
+                continue
+            self.fill_block(surface, color, x + dx, y + dy)
+    
+    def shape_sprite(self, shape):
+        # Sprite of a shape's bounding box, built on first use; its top-left
+        # corner is (shape.left, shape.top) from the anchor
+        if shape.sprite is None:
+            image = surface_pool.create((shape.right - shape.left, shape.bottom - shape.top), 0, 8)
+            image.set_palette(ANIMATION_PALETTE)
+            image.fill(SPRITE_COLORKEY)
+            image.set_colorkey(SPRITE_COLORKEY)
+            for dx, dy, color, clipped in shape.cells:
+                self.fill_block(image, color, dx - shape.left, dy - shape.top)
+            shape.sprite = image
+        return shape.sprite
+    
+    def animation_frame(self, name, progress, paint):
+        # Frame of an animation that depends only on progress, quantized to
+        # ANIMATION_FRAMES steps and painted on first use
+        step = self.animation_step(progress)
+        return self.animation_frames.get((name, step), lambda: self.bake_animation_frame(step, paint))
+    
+    def animation_step(self, progress):
+        # Index of the cached frame (and random stream) for this progress
+        return int(progress * (ANIMATION_FRAMES - 1) + 0.5)
+    
+    def animation_rng(self, name, progress):
+        # Random stream for one step of the current animation instance, seeded
+        # from the session seed, the animation start time and the step
+        key = "%d:%s:%r:%d" % (self.seed, name, self.animation_start_time, self.animation_step(progress))
+        return random.Random(key)
+    
+    def bake_animation_frame(self, step, paint):
+        # Animation frames only use a handful of colors, so they are stored as
+        # 8-bit palettized Surfaces at a quarter of the memory
+        frame = surface_pool.create((SCREEN_WIDTH, SCREEN_HEIGHT), 0, 8)
+        frame.set_palette(ANIMATION_PALETTE)
+        with self.batched_fills(frame):
+            paint(frame, step / (ANIMATION_FRAMES - 1))
+        return frame
+    
+    def paint_floor(self, surface, top):
+        # Draw cave floor in pixel art style from top to the bottom of the screen
+        for y in range(top, SCREEN_HEIGHT, PIXEL_SIZE):
             for x in range(0, SCREEN_WIDTH, PIXEL_SIZE):
                 # Create a checkerboard pattern for floor
                 if (x // (PIXEL_SIZE * 4) + y // (PIXEL_SIZE * 4)) % 2 == 0:
-                    pygame.draw.rect(screen, CAVE_FLOOR, (x, y, PIXEL_SIZE, PIXEL_SIZE))
+                    self.fill_block(surface, CAVE_FLOOR, x, y)
                 else:
-                    pygame.draw.rect(screen, (CAVE_FLOOR[0] - 20, CAVE_FLOOR[1] - 20, CAVE_FLOOR[2] - 20), 
-                                   (x, y, PIXEL_SIZE, PIXEL_SIZE))
-        
+                    self.fill_block(surface, (CAVE_FLOOR[0] - 20, CAVE_FLOOR[1] - 20, CAVE_FLOOR[2] - 20), x, y)
+    
+    def draw_animated_falling_rocks(self, surface):
         # Calculate animation progress (0.0 to 1.0)
-        progress = min(1.0, (time.time() - self.animation_start_time) / (self.transition_duration * 0.8))
-        
-        # Create a list of rocks with their positions
-        rocks = [
-            {"x": 100, "size": 80, "start_y": -100},
-            {"x": 300, "size": 120, "start_y": -200},
-            {"x": 500, "size": 90, "start_y": -150},
-            {"x": 200, "size": 70, "start_y": -250},
-            {"x": 600, "size": 100, "start_y": -180},
-            {"x": 400, "size": 110, "start_y": -300},
-            {"x": 700, "size": 60, "start_y": -220}
-        ]
+        progress = min(1.0, (self.render_time() - self.animation_start_time) / (self.transition_duration * 0.8))
         
-        # Draw rocks falling from top in pixel art style
-        for rock in rocks:
-            # Calculate current y position based on progress
-            # Rocks fall at different speeds based on their size
-            fall_speed = 600 + rock["size"] * 3  # Larger rocks fall faster
-            current_y = rock["start_y"] + fall_speed * progress
-            
-            # Draw rock in pixel art style
-            rock_x = rock["x"]
-            rock_y = int(current_y)
-            rock_size = rock["size"]
-            
-            # Draw rock as a collection of pixels
-            for y in range(rock_y - rock_size, rock_y + rock_size, PIXEL_SIZE):
-                for x in range(rock_x - rock_size, rock_x + rock_size, PIXEL_SIZE):
-                    # Only draw pixels within the rock's circular boundary
-                    if ((x - rock_x)**2 + (y - rock_y)**2 < rock_size**2 and
-                        0 <= x < SCREEN_WIDTH and 0 <= y < SCREEN_HEIGHT):
-                        
-                        # Create a pattern for the rock
-                        if ((x // (PIXEL_SIZE * 2) + y // (PIXEL_SIZE * 2)) % 2 == 0):
-                            pygame.draw.rect(screen, GRAY, (x, y, PIXEL_SIZE, PIXEL_SIZE))
-                        else:
-                            pygame.draw.rect(screen, (GRAY[0] - 30, GRAY[1] - 30, GRAY[2] - 30), 
-                                           (x, y, PIXEL_SIZE, PIXEL_SIZE))
-            
-            # Add motion blur effect (lines trailing behind rocks) in pixel art style
-            blur_length = 30
-            for y in range(rock_y - blur_length, rock_y, PIXEL_SIZE * 2):
-                # Calculate x position along the blur line
-                x_offset = int((rock_y - y) * rock_size / blur_length / 2)
-                
-                # Draw a few pixels for the blur
-                for x in range(rock_x - x_offset, rock_x + x_offset, PIXEL_SIZE * 2):
-                    if 0 <= x < SCREEN_WIDTH and 0 <= y < SCREEN_HEIGHT:
-                        pygame.draw.rect(screen, (GRAY[0] - 20, GRAY[1] - 20, GRAY[2] - 20), 
-                                       (x, y, PIXEL_SIZE, PIXEL_SIZE))
+        # The floor and rocks depend only on progress, so a cached frame is
+        # replayed; dust and cracks are drawn on top every frame
+        frame = self.animation_frame("falling_rocks", progress, self.paint_falling_rocks)
+        self.flush_fills()
+        surface.blit(frame, (0, 0))
+        self.draw_calls += 1
         
         # Add dust and small debris in pixel art style
-        for _ in range(50):
-            x = random.randint(0, SCREEN_WIDTH // PIXEL_SIZE) * PIXEL_SIZE
-            y = random.randint(0, int(SCREEN_HEIGHT * progress) // PIXEL_SIZE) * PIXEL_SIZE
-            size = random.randint(1, 2) * PIXEL_SIZE
-            pygame.draw.rect(screen, WHITE, (x, y, size, size))
+        self.draw_particles(surface, self.dust_particles(progress))
+        
+        # Cracks come from this frame's own random stream
+        rng = self.animation_rng("falling_rocks", progress)
         
         # Add cracks in the ceiling that grow with progress in pixel art style
         for i in range(5):
@@ -1063,7 +2346,7 @@ class Game:
             current_y = start_y
             
             for j in range(crack_length // (PIXEL_SIZE * 2)):
-                next_x = current_x + random.randint(-PIXEL_SIZE, PIXEL_SIZE)
+                next_x = current_x + rng.randint(-PIXEL_SIZE, PIXEL_SIZE)
                 next_y = current_y + PIXEL_SIZE * 2
                 
                 # Draw a few pixels for the crack
@@ -1071,7 +2354,7 @@ class Game:
                     # Interpolate x position
                     x = current_x + (next_x - current_x) * (y - current_y) // (next_y - current_y)
                     if 0 <= x < SCREEN_WIDTH and 0 <= y < SCREEN_HEIGHT:
-                        pygame.draw.rect(screen, BLACK, (x, y, PIXEL_SIZE, PIXEL_SIZE))
+                        self.fill_block(surface, BLACK, x, y)
                 
                 current_x = next_x
                 current_y = next_y
@@ -1080,28 +2363,65 @@ class Game:
                 if j % 3 == 0 and j > 0:
                     branch_x = current_x
                     branch_y = current_y
-                    branch_dir = random.choice([-1, 1])
+                    branch_dir = rng.choice([-1, 1])
                     
-                    for k in range(random.randint(2, 5)):
+                    for k in range(rng.randint(2, 5)):
                         branch_x += branch_dir * PIXEL_SIZE
                         branch_y += PIXEL_SIZE
                         if 0 <= branch_x < SCREEN_WIDTH and 0 <= branch_y < SCREEN_HEIGHT:
-                            pygame.draw.rect(screen, BLACK, (branch_x, branch_y, PIXEL_SIZE, PIXEL_SIZE))
+                            self.fill_block(surface, BLACK, branch_x, branch_y)
     
-    def draw_tunnel_movement(self):
+    def dust_particles(self, progress):
+        # Dust and small debris falling as far down as the rocks have come
+        count = self.effect_count(50)
+        rng = self.particle_rng("dust", progress)
+        x = rng.integers(0, SCREEN_WIDTH // PIXEL_SIZE, count, endpoint=True) * PIXEL_SIZE
+        y = rng.integers(0, int(SCREEN_HEIGHT * progress) // PIXEL_SIZE, count, endpoint=True) * PIXEL_SIZE
+        return Particles(x, y, rng.integers(1, 2, count, endpoint=True), WHITE)
+    
+    def paint_falling_rocks(self, surface, progress):
+        # Fill background
+        surface.fill(CAVE_DARK)
+        
+        # Draw cave floor in pixel art style
+        self.paint_floor(surface, SCREEN_HEIGHT//2)
+        
+        # Create a list of rocks with their positions
+        rocks = [
+            {"x": 100, "size": 80, "start_y": -100},
+            {"x": 300, "size": 120, "start_y": -200},
+            {"x": 500, "size": 90, "start_y": -150},
+            {"x": 200, "size": 70, "start_y": -250},
+            {"x": 600, "size": 100, "start_y": -180},
+            {"x": 400, "size": 110, "start_y": -300},
+            {"x": 700, "size": 60, "start_y": -220}
+        ]
+        
+        # Draw rocks falling from top in pixel art style
+        for rock in rocks:
+            # Calculate current y position based on progress
+            # Rocks fall at different speeds based on their size
+            fall_speed = 600 + rock["size"] * 3  # Larger rocks fall faster
+            rock_y = int(rock["start_y"] + fall_speed * progress)
+            
+            self.draw_shape(surface, self.rock_shape(rock["size"], rock["x"], rock_y), rock["x"], rock_y)
+    
+    def draw_tunnel_movement(self, surface):
         # Calculate how far into the transition we are
-        progress = min(1.0, (time.time() - self.transition_time) / (self.transition_duration * 0.8))
+        progress = min(1.0, (self.render_time() - self.transition_time) / (self.transition_duration * 0.8))
         
-        # Draw cave background in pixel art style
-        for y in range(0, SCREEN_HEIGHT, PIXEL_SIZE):
-            for x in range(0, SCREEN_WIDTH, PIXEL_SIZE):
-                # Create a pattern for background
-                darkness = int(255 * (1 - progress))
-                color = (darkness // 4, darkness // 6, 0)
-                pygame.draw.rect(screen, color, (x, y, PIXEL_SIZE, PIXEL_SIZE))
+        # Wall texture comes from this frame's own random stream
+        rng = self.animation_rng("tunnel", progress)
+        
+        # Block size for the background and segments at the current quality
+        block = self.quality.block_size()
+        
+        # Draw cave background in pixel art style, one fill of a uniform color
+        darkness = int(255 * (1 - progress))
+        self.fill_block(surface, (darkness // 4, darkness // 6, 0), 0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
         
         # Draw a tunnel that gets progressively longer as we move through it
-        tunnel_length = int(progress * 10)  # Number of tunnel segments
+        tunnel_length = int(progress * self.effect_count(10))  # Number of tunnel segments
         
         # Draw the tunnel segments in pixel art style
         for i in range(tunnel_length):
@@ -1114,100 +2434,180 @@ class Game:
             width = int(SCREEN_WIDTH * segment_size)
             height = int(SCREEN_HEIGHT * segment_size)
             
-            # Draw tunnel segment in pixel art style
-            for py in range(y - height//2, y + height//2, PIXEL_SIZE):
-                for px in range(x - width//2, x + width//2, PIXEL_SIZE):
-                    # Only draw the border pixels
-                    if (abs(px - (x - width//2)) < PIXEL_SIZE * 2 or 
-                        abs(px - (x + width//2 - PIXEL_SIZE)) < PIXEL_SIZE * 2 or
-                        abs(py - (y - height//2)) < PIXEL_SIZE * 2 or
-                        abs(py - (y + height//2 - PIXEL_SIZE)) < PIXEL_SIZE * 2):
-                        pygame.draw.rect(screen, CAVE_HIGHLIGHT, (px, py, PIXEL_SIZE, PIXEL_SIZE))
-                    else:
-                        pygame.draw.rect(screen, BLACK, (px, py, PIXEL_SIZE, PIXEL_SIZE))
+            # Draw tunnel segment in pixel art style: a highlighted border
+            # around a black interior, as four border fills and one interior fill
+            left, inner_left, inner_right, right = segment_edges(x - width//2, x + width//2, block)
+            top, inner_top, inner_bottom, bottom = segment_edges(y - height//2, y + height//2, block)
+            if inner_left < inner_right and inner_top < inner_bottom:
+                self.fill_block(surface, CAVE_HIGHLIGHT, left, top, right - left, inner_top - top)
+                self.fill_block(surface, CAVE_HIGHLIGHT, left, inner_top, inner_left - left, inner_bottom - inner_top)
+                self.fill_block(surface, BLACK, inner_left, inner_top, inner_right - inner_left,
+                                inner_bottom - inner_top)
+                self.fill_block(surface, CAVE_HIGHLIGHT, inner_right, inner_top, right - inner_right,
+                                inner_bottom - inner_top)
+                self.fill_block(surface, CAVE_HIGHLIGHT, left, inner_bottom, right - left, bottom - inner_bottom)
+            elif left < right and top < bottom:
+                self.fill_block(surface, CAVE_HIGHLIGHT, left, top, right - left, bottom - top)
             
             # Add some texture to tunnel walls in pixel art style
             if i % 2 == 0:  # Add texture to every other segment for performance
                 for _ in range(5):
-                    wall_x = random.randint(x - width//2, x + width//2) // PIXEL_SIZE * PIXEL_SIZE
-                    wall_y = random.randint(y - height//2, y + height//2) // PIXEL_SIZE * PIXEL_SIZE
+                    wall_x = rng.randint(x - width//2, x + width//2) // PIXEL_SIZE * PIXEL_SIZE
+                    wall_y = rng.randint(y - height//2, y + height//2) // PIXEL_SIZE * PIXEL_SIZE
                     # Only add texture near the edges
                     if (abs(wall_x - (x - width//2)) < PIXEL_SIZE * 4 or 
                         abs(wall_x - (x + width//2 - PIXEL_SIZE)) < PIXEL_SIZE * 4 or
                         abs(wall_y - (y - height//2)) < PIXEL_SIZE * 4 or
                         abs(wall_y - (y + height//2 - PIXEL_SIZE)) < PIXEL_SIZE * 4):
-                        pygame.draw.rect(screen, CAVE_HIGHLIGHT, (wall_x, wall_y, PIXEL_SIZE, PIXEL_SIZE))
+                        self.fill_block(surface, CAVE_HIGHLIGHT, wall_x, wall_y)
         
         # Add some motion blur lines for speed effect in pixel art style
-        for _ in range(30):
-            angle = random.uniform(0, 2 * math.pi)
-            length = random.randint(50, 200) * progress
-            start_x = SCREEN_WIDTH // 2
-            start_y = SCREEN_HEIGHT // 2
-            
-            # Draw dotted line for motion blur
-            for i in range(0, int(length), PIXEL_SIZE * 3):
-                pos_x = int(start_x + math.cos(angle) * i)
-                pos_y = int(start_y + math.sin(angle) * i)
-                
-                if (0 <= pos_x < SCREEN_WIDTH and 0 <= pos_y < SCREEN_HEIGHT):
-                    pygame.draw.rect(screen, (100, 100, 100), 
-                                   (pos_x, pos_y, PIXEL_SIZE, PIXEL_SIZE))
+        self.draw_particles(surface, self.blur_ray_particles(progress))
         
         # Add a bright flash at the end of the tunnel to transition to next scene
         if progress > 0.7:
             flash_alpha = int(255 * ((progress - 0.7) / 0.3))
             
             # Draw flash in pixel art style
-            for y in range(0, SCREEN_HEIGHT, PIXEL_SIZE * 2):
-                for x in range(0, SCREEN_WIDTH, PIXEL_SIZE * 2):
+            for y in range(0, SCREEN_HEIGHT, block * 2):
+                for x in range(0, SCREEN_WIDTH, block * 2):
                     # Create a checkerboard pattern for the flash
                     if (x // (PIXEL_SIZE * 4) + y // (PIXEL_SIZE * 4)) % 2 == 0:
                         brightness = min(255, flash_alpha + 50)
                     else:
                         brightness = flash_alpha
                     
-                    pygame.draw.rect(screen, (brightness, brightness, brightness), 
-                                   (x, y, PIXEL_SIZE * 2, PIXEL_SIZE * 2))
+                    self.fill_block(surface, (brightness, brightness, brightness), x, y, block * 2, block * 2)
+    
+    def blur_ray_particles(self, progress):
+        # Dotted motion blur rays out of the screen center, one dot every
+        # three blocks along each ray, growing longer with progress
+        count = self.effect_count(30)
+        rng = self.particle_rng("tunnel_rays", progress)
+        angle = rng.uniform(0, 2 * math.pi, count)
+        length = (rng.integers(50, 200, count, endpoint=True) * progress).astype(int)
+        
+        steps = numpy.arange(0, 200, PIXEL_SIZE * 3)
+        x = (SCREEN_WIDTH // 2 + numpy.cos(angle)[:, None] * steps).astype(int)
+        y = (SCREEN_HEIGHT // 2 + numpy.sin(angle)[:, None] * steps).astype(int)
+        visible = ((steps < length[:, None]) & (0 <= x) & (x < SCREEN_WIDTH) &
+                   (0 <= y) & (y < SCREEN_HEIGHT))
+        return Particles(x[visible], y[visible], 1, (100, 100, 100))
     
-    def draw_restart_message(self):
+    def draw_restart_message(self, surface):
         # Draw a simple text message instead of a button
         # Position it higher to avoid overlap with other messages
-        font = pygame.font.SysFont(None, 30)
-        text = font.render("Press SPACE to Restart", True, WHITE)
-        screen.blit(text, (SCREEN_WIDTH//2 - text.get_width()//2, SCREEN_HEIGHT - 50))
-    
-    def draw_message(self, message, color):
-        font = pygame.font.SysFont(None, 36)
-        text = font.render(message, True, color)
-        screen.blit(text, (SCREEN_WIDTH//2 - text.get_width()//2, SCREEN_HEIGHT - 100))
+        self.draw_centered_text(surface, "Press SPACE to Restart", 30, WHITE, SCREEN_HEIGHT - 50)
+    
+    def draw_message(self, surface, message, color):
+        self.draw_centered_text(surface, message, 36, color, SCREEN_HEIGHT - 100)
+    
+    def draw_centered_text(self, surface, text, size, color, y):
+        # Blit cached text horizontally centered at height y
+        rendered = self.text.render(text, size, color)
+        self.flush_fills()
+        surface.blit(rendered, (SCREEN_WIDTH//2 - rendered.get_width()//2, y))
+        self.draw_calls += 1
 
 # Main function
 def main():
-    game = Game()
+    # Bring the generated images up to date before the game needs them. This
+    # comes first: the build may start worker processes, which must not
+    # inherit an initialized display, and the window would stay black meanwhile
+    start = time.perf_counter()
+    asset_report = build_assets()
+    asset_build_ms = (time.perf_counter() - start) * 1000
+    
+    # Initialize pygame and open the window
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Cave Explorer")
+    clock = pygame.time.Clock()
+    
+    profiler = FrameProfiler.from_environment()
+    profiler.record_startup(asset_report, asset_build_ms)
+    presenter = Presenter()
+    
+    game = Game(profiler=profiler, clock=SimulationClock(), asset_report=asset_report)
+    timestep = FixedTimestep(game)
+    recorder = InputRecorder(INPUT_RECORDING, game.seed) if INPUT_RECORDING else None
+    stats = FrameStats.from_environment()
+    pacer = FramePacer() if LOW_LATENCY else None
+    last_frame = time.perf_counter()
+    frame_end = last_frame
+    poll_time = last_frame
     
     # Main game loop
     running = True
     while running:
-        # Handle events
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            elif event.type == pygame.KEYDOWN:
-                game.handle_key(event.key)
+        if pacer:
+            with profiler.stage("wait"):
+                pacer.wait()
         
-        # Update game state
-        game.update()
+        # Handle events
+        with profiler.stage("events"):
+            previous_poll, poll_time = poll_time, time.perf_counter()
+            keys = 0
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    presenter.invalidate()
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == PROFILER_KEY:
+                        profiler.toggle()
+                    elif event.key in GAME_KEYS:
+                        # Only keys the game acts on are recorded, which also
+                        # keeps unmapped keys (code 0) from ending the log
+                        if recorder:
+                            recorder.record(timestep.ticks, game.alpha, event.key)
+                        # Only keys with a visible effect count toward latency
+                        if game.handle_key(event.key):
+                            keys += 1
+        
+        # Update game state in fixed ticks for the real time that passed
+        with profiler.stage("update"):
+            now = time.perf_counter()
+            timestep.advance(now - last_frame)
+            last_frame = now
         
         # Draw everything
         game.draw(screen)
+        overlay_rect = profiler.draw_overlay(screen)
         
         # Update the display
-        pygame.display.flip()
+        with profiler.stage("flip"):
+            presenter.present(game, [overlay_rect])
+        stats.record_presented(presenter.presented_area)
+        
+        # Keys that changed the game this frame are on screen from the end of the flip
+        shown = time.perf_counter()
+        for _ in range(keys):
+            stats.record_latency((shown - poll_time) * 1000, (shown - previous_poll) * 1000)
+        
+        # Adapt the quality level to the time the frame took, without the wait.
+        # Low-latency mode already waited before the frame; otherwise the frame
+        # rate is capped here
+        if pacer:
+            game.quality.record(pacer.frame_done(), game.state)
+        else:
+            with profiler.stage("tick"):
+                clock.tick(FPS)
+            game.quality.record(clock.get_rawtime(), game.state)
+        
+        # Frame-time telemetry takes the whole frame, wait included, as seen on screen
+        previous_end, frame_end = frame_end, time.perf_counter()
+        effect = game.transition_effect["type"] if game.transition_effect else None
+        stats.record((frame_end - previous_end) * 1000, game.state, effect)
         
-        # Cap the frame rate
-        clock.tick(FPS)
+        if profiler.enabled:
+            profiler.end_frame(game.state, game.quality.level, game.counters())
     
+    if recorder:
+        recorder.close(timestep.ticks)
+    stats.close()
+    profiler.record_asset_usage(game.images.usage())
+    profiler.close()
     pygame.quit()
     sys.exit()
 
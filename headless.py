@@ -0,0 +1,40 @@
+import json
+import os
+
+# Helpers shared by the command-line tools. Import this before pygame: the tools
+# render off-screen, so SDL gets the dummy video driver, and pygame's import
+# banner is hidden so the JSON reports on stdout stay valid
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+START_TIME = 1000.0  # Clock value at which every posed animation starts
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def pose_game(game, state, progress, perspective_offset=0.0, flicker=0.0):
+    # Put a Game on a SimulationClock into state at the given animation progress,
+    # from its start (0) to its end (1), looking at the middle path
+    game.state = state
+    game.selected_path = 1
+    game.success_count = 0
+    game.perspective_offset = game.perspective_target = perspective_offset
+    game.previous_offset = perspective_offset
+    game.torch_flicker = game.previous_flicker = flicker
+    game.transition_effect = None
+    game.transition_time = START_TIME
+    game.animation_start_time = START_TIME
+    game.clock.now = START_TIME + progress * game.transition_duration * 0.8
+    game.set_interpolation(1.0)
+
+def write_report(results, output=None):
+    # Print results as JSON and, if output is given, also write them there.
+    # Returns the JSON text
+    report = json.dumps(results, indent=2)
+    print(report)
+    if output:
+        with open(output, 'w') as f:
+            f.write(report + "\n")
+    return report
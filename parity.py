@@ -0,0 +1,187 @@
+import argparse
+import atexit
+import importlib
+import importlib.util
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+
+from headless import pose_game, write_report, START_TIME
+
+import numpy
+import pygame
+
+from cave_explorer import Game, SimulationClock, build_assets, SCREEN_WIDTH, SCREEN_HEIGHT
+
+SEEDS = [1, 2]
+PROGRESSES = [0.0, 0.25, 0.5, 0.75, 1.0]  # Animation progress of the animated states
+OFFSETS = [-0.3, -0.1, 0.0, 0.1, 0.3]  # Perspective offsets of the playing state
+REPEATS = 5  # Timed renders per case and implementation, after a warm-up render
+
+# Revision whose cave_explorer.py draws the reference frames: the last one that
+# fills every block on its own, before fill batching and the polygon rasterizer
+REFERENCE_REVISION = 'b00a08c'
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def default_cases(seeds=SEEDS):
+    # (state, seed, progress, perspective offset) grid: the playing state at
+    # every view angle, the other states over their whole animation
+    cases = []
+    for seed in seeds:
+        cases += [("playing", seed, 0.0, offset) for offset in OFFSETS]
+        for state in ("success", "trap", "dead_end", "victory"):
+            cases += [(state, seed, progress, 0.0) for progress in PROGRESSES]
+    return cases
+
+# Modules loaded from git revisions, by revision
+revision_modules = {}
+
+def load_revision(revision):
+    # Import cave_explorer.py as it was at a git revision, as a module of its
+    # own next to the shipped one. It is written to a temporary directory, so
+    # it builds its images into that directory's images/ and never touches
+    # the tracked ones
+    if revision not in revision_modules:
+        source = subprocess.run(['git', 'show', '%s:cave_explorer.py' % revision], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        directory = tempfile.mkdtemp(prefix='cave_reference_')
+        atexit.register(shutil.rmtree, directory, True)
+        path = os.path.join(directory, 'cave_explorer.py')
+        with open(path, 'w') as f:
+            f.write(source)
+        
+        # Registered under its own name, so pool workers building its images can find it
+        name = 'cave_explorer_' + re.sub(r'\W', '_', revision)
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        
+        # Later revisions leave building the images to their caller
+        module.build_assets()
+        revision_modules[revision] = module
+    return revision_modules[revision]
+
+def revision_game(revision, seed):
+    # A Game from cave_explorer.py at a git revision (one that takes seed and
+    # clock, i.e. any revision since the seeded animation streams)
+    module = load_revision(revision)
+    return module.Game(seed=seed, clock=module.SimulationClock(START_TIME))
+
+def reference_game(seed):
+    # The per-rect renderer at REFERENCE_REVISION: every block filled on its
+    # own, walls and spikes drawn block by block
+    return revision_game(REFERENCE_REVISION, seed)
+
+def unbatched_game(seed):
+    # The shipped renderer with fill batching turned off. Compared with the
+    # shipped renderer it checks only that merging fills changes no pixels
+    return Game(seed=seed, clock=SimulationClock(START_TIME), batch_fills=False)
+
+def candidate_game(seed):
+    # The renderer as shipped
+    return Game(seed=seed, clock=SimulationClock(START_TIME))
+
+def load_factory(spec):
+    # "module:function" naming a function (seed) -> Game
+    module, name = spec.split(':')
+    return getattr(importlib.import_module(module), name)
+
+def render_case(game, case, surface, repeats):
+    # Render a case once to warm the caches, then time repeats more renders of
+    # it. Returns the mean milliseconds per render
+    state, seed, progress, offset = case
+    pose_game(game, state, progress, offset)
+    game.render_frame(surface)
+    
+    start = time.perf_counter()
+    for _ in range(repeats):
+        pose_game(game, state, progress, offset)
+        game.render_frame(surface)
+    return (time.perf_counter() - start) * 1000 / max(1, repeats)
+
+def save_diff(path, reference, candidate, mismatched):
+    # Reference, candidate and the mismatched pixels (red over the dimmed
+    # reference) side by side
+    marked = reference // 3
+    marked[mismatched] = (255, 0, 0)
+    image = numpy.concatenate([reference, candidate, marked], axis=0)
+    pygame.image.save(pygame.surfarray.make_surface(image), path)
+
+def run_parity(cases, reference=reference_game, candidate=candidate_game, tolerance=0,
+               repeats=REPEATS, diff_dir=None):
+    pygame.font.init()
+    games = {}
+    surfaces = (pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)), pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)))
+    
+    results = []
+    for case in cases:
+        state, seed, progress, offset = case
+        if seed not in games:
+            games[seed] = (reference(seed), candidate(seed))
+        
+        reference_ms, candidate_ms = [render_case(game, case, surface, repeats)
+                                      for game, surface in zip(games[seed], surfaces)]
+        
+        # A pixel mismatches when any of its channels differs by more than the tolerance
+        expected, actual = [pygame.surfarray.array3d(surface) for surface in surfaces]
+        difference = numpy.abs(expected.astype(int) - actual.astype(int))
+        mismatched = (difference > tolerance).any(axis=2)
+        
+        name = "%s_%d_%g_%g" % case
+        result = {
+            "case": name,
+            "max_difference": int(difference.max()),
+            "mismatched_pixels": int(mismatched.sum()),
+            "reference_ms": round(reference_ms, 3),
+            "candidate_ms": round(candidate_ms, 3),
+            "speedup": round(reference_ms / candidate_ms, 2) if candidate_ms else None,
+        }
+        if result["mismatched_pixels"] and diff_dir:
+            os.makedirs(diff_dir, exist_ok=True)
+            result["diff_image"] = os.path.join(diff_dir, name + ".png")
+            save_diff(result["diff_image"], expected, actual, mismatched)
+        results.append(result)
+    
+    reference_total = sum(result["reference_ms"] for result in results)
+    candidate_total = sum(result["candidate_ms"] for result in results)
+    return {
+        "tolerance": tolerance,
+        "cases": results,
+        "mismatches": [result["case"] for result in results if result["mismatched_pixels"]],
+        "speedup": round(reference_total / candidate_total, 2) if candidate_total else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that a Cave Explorer renderer draws the same pixels as a reference")
+    parser.add_argument('--reference', type=load_factory, default=None,
+                        help="module:function (seed) -> Game drawing the expected frames, e.g. "
+                             "parity:unbatched_game (default: cave_explorer.py at --reference-rev)")
+    parser.add_argument('--reference-rev', default=REFERENCE_REVISION,
+                        help="git revision of cave_explorer.py drawing the expected frames (default %(default)s)")
+    parser.add_argument('--candidate', type=load_factory, default=candidate_game,
+                        help="module:function (seed) -> Game to check (default: the shipped renderer)")
+    parser.add_argument('--tolerance', type=int, default=0, help="largest allowed difference per color channel")
+    parser.add_argument('--repeats', type=int, default=REPEATS, help="timed renders per case")
+    parser.add_argument('--diff-dir', default='parity_diffs', help="directory for images of mismatching cases")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+    
+    # Both games load the same images, brought up to date once here
+    build_assets()
+    reference = args.reference or partial(revision_game, args.reference_rev)
+    results = run_parity(default_cases(), reference, args.candidate, args.tolerance,
+                         args.repeats, args.diff_dir)
+    
+    write_report(results, args.output)
+    
+    if results["mismatches"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
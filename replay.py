@@ -0,0 +1,88 @@
+import argparse
+import time
+
+from headless import percentile, write_report
+
+import pygame
+
+from cave_explorer import (Game, FixedTimestep, SimulationClock, build_assets, read_input_log, SCREEN_WIDTH,
+                           SCREEN_HEIGHT)
+
+def replay(path, render=False):
+    # Feed a recorded session back through Game.handle_key and Game.update one
+    # tick at a time. With render set, every tick is also drawn into an
+    # off-screen Surface and the draw is timed
+    seed, events, end_tick = read_input_log(path)
+    if end_tick is None:
+        end_tick = events[-1][0] if events else 0
+    
+    clock = SimulationClock()
+    game = Game(seed=seed, clock=clock)
+    timestep = FixedTimestep(game)
+    surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)) if render else None
+    
+    transitions = [(0, game.state)]
+    frame_times = {}
+    index = 0
+    start = time.perf_counter()
+    while True:
+        # Keys arrive before the update of the tick they were recorded on, at
+        # the interpolation of the frame that was on screen
+        while index < len(events) and events[index][0] <= timestep.ticks:
+            tick, alpha, key = events[index]
+            game.set_interpolation(alpha)
+            game.handle_key(key)
+            index += 1
+        if game.state != transitions[-1][1]:
+            transitions.append((timestep.ticks, game.state))
+        
+        if timestep.ticks >= end_tick:
+            break
+        timestep.step()
+        
+        if render:
+            game.set_interpolation(1.0)
+            frame_start = time.perf_counter()
+            game.draw(surface)
+            frame_times.setdefault(game.state, []).append((time.perf_counter() - frame_start) * 1000)
+    elapsed = time.perf_counter() - start
+    
+    results = {
+        "seed": seed,
+        "events": len(events),
+        "ticks": timestep.ticks,
+        "render": render,
+        "seconds": round(elapsed, 3),
+        "ticks_per_second": round(timestep.ticks / elapsed) if elapsed else None,
+        "final": {"state": game.state, "success_count": game.success_count},
+        "transitions": transitions,
+    }
+    if render:
+        results["states"] = {
+            state: {
+                "frames": len(times),
+                "mean_ms": round(sum(times) / len(times), 3),
+                "p50_ms": round(percentile(times, 0.5), 3),
+                "p99_ms": round(percentile(times, 0.99), 3),
+                "max_ms": round(max(times), 3),
+            }
+            for state, times in frame_times.items()
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a Cave Explorer input log recorded with CAVE_RECORD")
+    parser.add_argument('log', help="input log to replay")
+    parser.add_argument('--render', action='store_true', help="draw every tick off-screen and time the frames")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+    
+    # Only drawing needs the images; bring them up to date first
+    if args.render:
+        build_assets()
+    results = replay(args.log, args.render)
+    
+    write_report(results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from headless import write_report
+
+from cave_explorer import GameRules, play_game, PATH_CENTERS, WIN_STREAK, TRAP_CHANCE
+
+BATCH_SIZE = 50000  # Games played by one worker task
+
+def simulate_batch(games, seed, paths, win_streak, trap_chance):
+    # Play games on their own random stream. Returns the final states and the
+    # number of correct paths taken in each game
+    rng = random.Random(seed)
+    outcomes = Counter()
+    streaks = Counter()
+    for _ in range(games):
+        rules = GameRules(rng, paths, win_streak, trap_chance)
+        outcomes[play_game(rules, rng)] += 1
+        streaks[rules.success_count] += 1
+    return outcomes, streaks
+
+def expected_outcomes(paths, win_streak, trap_chance):
+    # Exact outcome probabilities for a player choosing paths at random
+    victory = (1 / paths) ** win_streak
+    return {
+        "victory": victory,
+        "trap": (1 - victory) * trap_chance,
+        "dead_end": (1 - victory) * (1 - trap_chance),
+    }
+
+def run_simulation(games, seed=0, workers=1, paths=len(PATH_CENTERS), win_streak=WIN_STREAK,
+                   trap_chance=TRAP_CHANCE, batch_size=BATCH_SIZE):
+    sizes = [min(batch_size, games - start) for start in range(0, games, batch_size)]
+    seeds = ["%d:%d" % (seed, batch) for batch in range(len(sizes))]
+    count = len(sizes)
+    
+    start = time.perf_counter()
+    if workers > 1 and count > 1:
+        with ProcessPoolExecutor(min(workers, count)) as pool:
+            results = list(pool.map(simulate_batch, sizes, seeds, [paths] * count, [win_streak] * count,
+                                    [trap_chance] * count))
+    else:
+        results = [simulate_batch(size, batch_seed, paths, win_streak, trap_chance)
+                   for size, batch_seed in zip(sizes, seeds)]
+    elapsed = time.perf_counter() - start
+    
+    outcomes = Counter()
+    streaks = Counter()
+    for batch_outcomes, batch_streaks in results:
+        outcomes.update(batch_outcomes)
+        streaks.update(batch_streaks)
+    
+    return {
+        "games": games,
+        "seed": seed,
+        "workers": workers,
+        "rules": {"paths": paths, "win_streak": win_streak, "trap_chance": trap_chance},
+        "outcomes": {state: round(outcomes[state] / games, 6) for state in ("victory", "trap", "dead_end")},
+        "expected": {state: round(p, 6) for state, p in expected_outcomes(paths, win_streak, trap_chance).items()},
+        "streaks": {count: round(streaks[count] / games, 6) for count in sorted(streaks)},
+        "seconds": round(elapsed, 3),
+        "games_per_second": round(games / elapsed) if elapsed else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Play Cave Explorer games headless and report their outcomes")
+    parser.add_argument('--games', type=int, default=1000000, help="number of games to play")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random streams")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument('--paths', type=int, default=len(PATH_CENTERS), help="paths at every fork")
+    parser.add_argument('--win-streak', type=int, default=WIN_STREAK, help="correct paths needed to win")
+    parser.add_argument('--trap-chance', type=float, default=TRAP_CHANCE,
+                        help="chance that a wrong path is a trap rather than a dead end")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+    
+    # Refuse rules no game can be played with before any worker starts
+    for name in ('games', 'workers', 'paths', 'win_streak'):
+        if getattr(args, name) < 1:
+            parser.error("--%s must be at least 1" % name.replace('_', '-'))
+    if not 0 <= args.trap_chance <= 1:
+        parser.error("--trap-chance must be between 0 and 1")
+    
+    results = run_simulation(args.games, args.seed, args.workers, args.paths, args.win_streak, args.trap_chance)
+    
+    write_report(results, args.output)
+
+if __name__ == "__main__":
+    main()